@@ -0,0 +1,205 @@
+from collections import Counter, OrderedDict, deque
+from settings import parse_user_settings, InvalidSettings
+from fastapi import Request
+from api import tmdb
+import ipaddress
+import asyncio
+import prefetch
+import os
+
+# Requests handled at the same time (per worker)
+MAX_INFLIGHT = int(os.getenv('MAX_INFLIGHT', 64))
+# Share of MAX_INFLIGHT each route class can use, the rest is left to higher priorities
+ROUTE_SHARES = {
+    'meta': 1.0,
+    'catalog': 0.6,
+    'prefetch': 0.2
+}
+# Admission order of waiting requests
+PRIORITIES = ['meta', 'catalog', 'prefetch']
+# Requests in flight for a single client address, and for a single TMDB key
+CLIENT_LIMIT = int(os.getenv('CLIENT_LIMIT', 8))
+# Waiting requests, over this they are rejected at once
+QUEUE_LIMIT = int(os.getenv('QUEUE_LIMIT', 256))
+# Max wait for a slot (seconds)
+QUEUE_TIMEOUT = float(os.getenv('QUEUE_TIMEOUT', 3))
+# Retry-After of rejected requests (seconds)
+RETRY_AFTER = 5
+# Upstream timeout of the untranslated catalog given to rejected requests (seconds)
+FALLBACK_TIMEOUT = 3
+# Proxies whose client address headers are trusted (comma separated addresses or networks)
+TRUSTED_PROXIES = [ipaddress.ip_network(item.strip(), strict=False) for item in os.getenv('TRUSTED_PROXIES', '').split(',') if item.strip()]
+# TMDB calls of background catalog enrichment per key, the rest is left to metas
+ENRICH_CONCURRENCY = tmdb.TMDB_CONCURRENCY // 2
+
+
+class Admission():
+    """
+    Bounded in-flight requests per route class. Waiting requests are admitted by
+    priority (meta before catalog before prefetch) and round robin between clients,
+    so a client scrolling many catalogs does not delay the others.
+    """
+
+    def __init__(self, capacity: int = MAX_INFLIGHT):
+        self.capacity = capacity
+        self.limits = {route: max(1, int(capacity * share)) for route, share in ROUTE_SHARES.items()}
+        self.inflight = Counter()
+        self.inflight_clients = Counter()
+        # Route -> client -> waiting futures
+        self.queues = {route: OrderedDict() for route in PRIORITIES}
+        self.queued = 0
+        self.rejected = Counter()
+
+    def can_run(self, route: str, client: tuple) -> bool:
+        return (sum(self.inflight.values()) < self.capacity
+                and self.inflight[route] < self.limits[route]
+                and not self.client_limited(client))
+
+    def client_limited(self, client: tuple) -> bool:
+        return any(self.inflight_clients[key] >= CLIENT_LIMIT for key in client if key != None)
+
+    def has_waiting(self, route: str) -> bool:
+        # Waiting requests of the same or higher priority go first,
+        # unless only held back by the limit of their own client
+        for item in PRIORITIES[:PRIORITIES.index(route) + 1]:
+            for client in self.queues[item]:
+                if not self.client_limited(client):
+                    return True
+        return False
+
+    def start(self, route: str, client: tuple):
+        self.inflight[route] += 1
+        for key in client:
+            if key != None:
+                self.inflight_clients[key] += 1
+
+    async def acquire(self, route: str, client: tuple) -> bool:
+        """
+        Wait for a slot, False when the queue is full or the wait timed out.
+        """
+        if not self.has_waiting(route) and self.can_run(route, client):
+            self.start(route, client)
+            return True
+        if self.queued >= QUEUE_LIMIT:
+            self.rejected[route] += 1
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        self.queues[route].setdefault(client, deque()).append(future)
+        self.queued += 1
+        # Free slots are not only given on release
+        self.dispatch()
+        try:
+            await asyncio.wait({future}, timeout=QUEUE_TIMEOUT)
+        except asyncio.CancelledError:
+            # Client gone right after the slot was given
+            if future.done() and not future.cancelled():
+                self.release(route, client)
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+                self.remove(route, client, future)
+        if future.cancelled():
+            self.rejected[route] += 1
+            return False
+        return True
+
+    def remove(self, route: str, client: tuple, future):
+        waiting = self.queues[route].get(client)
+        if waiting != None and future in waiting:
+            waiting.remove(future)
+            self.queued -= 1
+            if not waiting:
+                del self.queues[route][client]
+
+    def release(self, route: str, client: tuple):
+        self.inflight[route] -= 1
+        for key in client:
+            if key != None:
+                self.inflight_clients[key] -= 1
+                if self.inflight_clients[key] <= 0:
+                    del self.inflight_clients[key]
+        self.dispatch()
+
+    def dispatch(self):
+        for route in PRIORITIES:
+            queue = self.queues[route]
+            # One waiting request per client in turn
+            for client in list(queue):
+                if not self.can_run(route, client):
+                    continue
+                waiting = queue.pop(client)
+                future = waiting.popleft()
+                self.queued -= 1
+                if waiting:
+                    queue[client] = waiting
+                self.start(route, client)
+                future.set_result(True)
+
+    def status(self) -> dict:
+        return {
+            "inflight": dict(self.inflight),
+            "queued": {route: sum(len(waiting) for waiting in queue.values()) for route, queue in self.queues.items()},
+            "rejected": dict(self.rejected),
+            "limits": self.limits
+        }
+
+
+controller = Admission()
+
+# Per worker TMDB key slots of catalog enrichment
+enrich_slots = {}
+def enrichment_slots(tmdb_key: str) -> asyncio.Semaphore:
+    if tmdb_key not in enrich_slots:
+        enrich_slots[tmdb_key] = asyncio.Semaphore(ENRICH_CONCURRENCY)
+    return enrich_slots[tmdb_key]
+
+
+def classify(request: Request) -> str | None:
+    """
+    Route class of addon requests, None for the others (not admission controlled).
+    """
+    parts = request.url.path.split('/')
+    if len(parts) < 5 or parts[3] not in ('meta', 'catalog'):
+        return None
+    if prefetch.is_prefetch(request):
+        return 'prefetch'
+    return parts[3]
+
+
+def client_key(request: Request) -> tuple:
+    """
+    Fairness keys: (client address, TMDB key of the user settings or None).
+    """
+    address = client_address(request)
+    try:
+        tmdb_key = parse_user_settings(request.url.path.split('/')[2]).tmdb_key
+    except InvalidSettings:
+        tmdb_key = None
+    return (f"ip:{address}", f"key:{tmdb_key}" if tmdb_key else None)
+
+
+def client_address(request: Request) -> str:
+    """
+    Peer address, or the address forwarded by a trusted proxy (headers of the others are ignored).
+    """
+    address = request.client.host if request.client != None else ''
+    if not is_trusted_proxy(address):
+        return address
+    if request.headers.get('cf-connecting-ip'):
+        return request.headers['cf-connecting-ip'].strip()
+    # Last hop not added by a trusted proxy
+    hops = [hop.strip() for hop in request.headers.get('x-forwarded-for', '').split(',') if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop):
+            return hop
+    return address
+
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
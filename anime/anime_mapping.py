@@ -1,7 +1,9 @@
+from diskcache import Cache as diskCache
 import httpx
 import bisect
 import json
 import asyncio
+import time
 
 # Map for IDs
 anime_mapping_url = 'https://raw.githubusercontent.com/Fribb/anime-lists/refs/heads/master/anime-list-full.json'
@@ -19,6 +21,78 @@ with open("anime/anidb_extension.json", "r", encoding="utf-8") as f:
 with open("anime/anime_mapping_extension.json", "r", encoding="utf-8") as f:
     anime_mapping_extension = json.load(f) 
 
+# Max age of the shared index before a worker rebuilds it at startup
+MAP_MAX_AGE = 24 * 3600
+
+
+class SharedIndex():
+    """
+    Read only map published in a shared SQLite file.
+    Every worker reads the same memory mapped pages instead of keeping its own copy.
+    Records are tagged by version: a new version is written first, then swapped in.
+    """
+
+    def __init__(self, dir: str):
+        self.dir = dir
+        self.store = None
+        self.version = None
+
+    def open(self):
+        self.store = diskCache(self.dir, sqlite_cache_size=10000, sqlite_mmap_size=2**28, disk_min_file_size=0, tag_index=True)
+        self.refresh()
+
+    def close(self):
+        if self.store != None:
+            self.store.close()
+
+    def refresh(self):
+        info = self.store.get('version', {})
+        self.version = info.get('version')
+
+    def is_fresh(self, max_age: float = MAP_MAX_AGE) -> bool:
+        info = self.store.get('version', {})
+        return info.get('built_at', 0) > time.time() - max_age
+
+    def publish(self, mapping: dict) -> int:
+        # The previous version is kept until the next publish: other workers read it until they refresh
+        info = self.store.get('version', {})
+        version = int(time.time() * 1000)
+        with self.store.transact():
+            for key, value in mapping.items():
+                self.store.set((version, key), value, tag=version)
+            self.store.set('version', {"version": version, "previous": info.get('version'), "built_at": time.time(), "size": len(mapping)})
+        self.version = version
+        if info.get('previous') != None:
+            self.store.evict(info['previous'])
+        return version
+
+    def get(self, key, default=None):
+        if self.version == None:
+            return default
+        return self.store.get((self.version, key), default)
+
+    def __contains__(self, key):
+        return self.version != None and (self.version, key) in self.store
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value == None:
+            raise KeyError(key)
+        return value
+
+
+# Imdb id -> kitsu, anidb and mal ids (shared by kitsu and mal)
+imdb_index = SharedIndex('./cache/anime/index')
+def open_cache():
+    imdb_index.open()
+
+def close_cache():
+    imdb_index.close()
+
+def build_index():
+    return imdb_index.publish(load_imdb_map())
+
+
 async def download_maps():
     global anime_id_map, anime_season_map
     async with httpx.AsyncClient(timeout=20) as client:
@@ -27,8 +101,10 @@ async def download_maps():
             client.get(anime_db_map_url)
         ]
         results = await asyncio.gather(*tasks)
-        anime_id_map = results[0].json() + anime_mapping_extension
-        anime_season_map = {**results[1].json(), **anidb_extension}
+        # Parse off the event loop, then swap both maps
+        id_map, season_map = await asyncio.to_thread(lambda: (results[0].json(), results[1].json()))
+        anime_id_map = id_map + anime_mapping_extension
+        anime_season_map = {**season_map, **anidb_extension}
         
 
 def load_kitsu_map() -> dict:
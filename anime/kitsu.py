@@ -1,6 +1,8 @@
 from cache import Cache
 from datetime import timedelta
 import httpx
+import upstream
+import freshness
 import anime.anime_mapping as anime_mapping
 
 kitsu_addon_url = 'https://kitsufortheweebs.midnightignite.me'
@@ -9,7 +11,7 @@ kitsu_addon_url = 'https://kitsufortheweebs.midnightignite.me'
 kitsu_cache_ids = None
 def open_cache():
 	global kitsu_cache_ids
-	kitsu_cache_ids = Cache('./cache/kitsu/ids', timedelta(days=30).total_seconds())
+	kitsu_cache_ids = Cache('./cache/kitsu/ids', timedelta(days=30).total_seconds(), namespace='kitsu')
 
 def close_cache():
 	global kitsu_cache_ids
@@ -22,32 +24,33 @@ def get_cache_lenght():
 	
 
 # Anime mapping loading
-imdb_ids_map = None
+imdb_ids_map = anime_mapping.imdb_index
 imdb_map = None
 
 def load_anime_map():
-	global imdb_ids_map, imdb_map
+	global imdb_map
 	# Load kitsu -> imdb converter
-	imdb_map = anime_mapping.load_kitsu_map()
-	for kitsu_id, imdb_id in imdb_map.items():
-		kitsu_cache_ids.set(f"kitsu:{kitsu_id}", imdb_id)
-
-	# Load season / episode map
-	imdb_ids_map = anime_mapping.load_imdb_map()
+	new_map = anime_mapping.load_kitsu_map()
+	# One transaction, then swap the map
+	kitsu_cache_ids.set_many({f"kitsu:{kitsu_id}": imdb_id for kitsu_id, imdb_id in new_map.items()})
+	imdb_map = new_map
 
 async def convert_to_imdb(kitsu_id: str, type: str):
 	is_converted = False
-	imdb_id = kitsu_cache_ids.get(kitsu_id)
+	imdb_id = await kitsu_cache_ids.aget(kitsu_id)
 	if imdb_id == None:
 		async with httpx.AsyncClient(follow_redirects=True, timeout=20) as client:
-			response = await client.get(f"{kitsu_addon_url}/meta/{type}/{kitsu_id.replace(':','%3A')}.json")
+			status, meta = await upstream.get_source_meta(client, kitsu_addon_url, f"{kitsu_addon_url}/meta/{type}/{kitsu_id.replace(':','%3A')}.json")
+			# Addon down: not converted, not cached
+			if status == None or status >= 500:
+				return kitsu_id, is_converted
 			try:
-				imdb_id = response.json()['meta']['imdb_id']
-				kitsu_cache_ids.set(kitsu_id, imdb_id)
+				imdb_id = meta['meta']['imdb_id']
+				kitsu_cache_ids.set_later(kitsu_id, imdb_id, freshness.anime_id_ttl(imdb_id))
 				is_converted = True
 			except:
 				# If imdb_id not found save kitsu_id as imdb_id (better performance)
-				kitsu_cache_ids.set(kitsu_id, kitsu_id)
+				kitsu_cache_ids.set_later(kitsu_id, kitsu_id, freshness.ANIME_ID_MISS_TTL)
 				return kitsu_id, is_converted
 	else:
 		if 'tt' not in imdb_id:
@@ -1,6 +1,8 @@
 from cache import Cache
 from datetime import timedelta
 import httpx
+import upstream
+import freshness
 import anime.anime_mapping as anime_mapping
 
 kitsu_addon_url = 'https://anime-kitsu.strem.fun'
@@ -9,7 +11,7 @@ kitsu_addon_url = 'https://anime-kitsu.strem.fun'
 mal_cache_ids = None
 def open_cache():
 	global mal_cache_ids
-	mal_cache_ids = Cache('./cache/mal/ids', timedelta(days=30).total_seconds())
+	mal_cache_ids = Cache('./cache/mal/ids', timedelta(days=30).total_seconds(), namespace='mal')
 
 def close_cache():
 	global mal_cache_ids
@@ -20,32 +22,33 @@ def get_cache_lenght():
 	return mal_cache_ids.get_len()
 
 # Anime mapping loading
-imdb_ids_map = None
+imdb_ids_map = anime_mapping.imdb_index
 imdb_map = None
 
 def load_anime_map():
-	global imdb_ids_map, imdb_map
+	global imdb_map
 	# Load MAL -> IMDB converter
-	imdb_map = anime_mapping.load_mal_map()
-	for mal_id, imdb_id in imdb_map.items():
-		mal_cache_ids.set(f"mal:{mal_id}", imdb_id)
-
-	# Load season / episode map
-	imdb_ids_map = anime_mapping.load_imdb_map()
+	new_map = anime_mapping.load_mal_map()
+	# One transaction, then swap the map
+	mal_cache_ids.set_many({f"mal:{mal_id}": imdb_id for mal_id, imdb_id in new_map.items()})
+	imdb_map = new_map
 
 async def convert_to_imdb(mal_id: str, type: str) -> str:
 	is_converted = False
-	imdb_id = mal_cache_ids.get(mal_id)
+	imdb_id = await mal_cache_ids.aget(mal_id)
 	if imdb_id == None:
 		async with httpx.AsyncClient(follow_redirects=True, timeout=20) as client:
-			response = await client.get(f"{kitsu_addon_url}/meta/{type}/{mal_id.replace(':','%3A')}.json")
+			status, meta = await upstream.get_source_meta(client, kitsu_addon_url, f"{kitsu_addon_url}/meta/{type}/{mal_id.replace(':','%3A')}.json")
+			# Addon down: not converted, not cached
+			if status == None or status >= 500:
+				return mal_id, is_converted
 			try:
-				imdb_id = response.json()['meta']['imdb_id']
-				mal_cache_ids.set(mal_id, imdb_id)
+				imdb_id = meta['meta']['imdb_id']
+				mal_cache_ids.set_later(mal_id, imdb_id, freshness.anime_id_ttl(imdb_id))
 				is_converted = True
 			except:
 				# If imdb_id not found save mal_id as imdb_id (better performance)
-				mal_cache_ids.set(mal_id, mal_id)
+				mal_cache_ids.set_later(mal_id, mal_id, freshness.ANIME_ID_MISS_TTL)
 				return mal_id, is_converted
 	else:
 		if 'tt' not in imdb_id:
@@ -1,35 +1,72 @@
+from cache import Cache
+from datetime import timedelta
+import coordination
 import httpx
+import breaker
 import os
 
 #from dotenv import load_dotenv
 #load_dotenv()
 
 FANART_API_KEY = os.getenv('FANART_API_KEY')
+FANART_TTL = timedelta(days=7).total_seconds()
+# Not found on fanart, retried sooner
+FANART_MISS_TTL = timedelta(days=1).total_seconds()
 
+# Cache set
+fanart_cache = None
+def open_cache():
+    global fanart_cache
+    fanart_cache = Cache('./cache/fanart/tmp', FANART_TTL, namespace='fanart')
 
-async def get_fanart_movie(client: httpx.AsyncClient, id: str) -> dict:
-    params = {
-        "api_key": FANART_API_KEY
-    }
+def close_cache():
+    global fanart_cache
+    fanart_cache.close()
 
-    url = f"http://webservice.fanart.tv/v3/movies/{id}"
-    response = await client.get(url, params=params)
+def get_cache_lenght():
+    global fanart_cache
+    return fanart_cache.get_len()
 
-    if response.status_code == 200:
-        return response.json()
-    else:
-            return {"error": response.status_code}
+
+async def get_fanart_movie(client: httpx.AsyncClient, id: str) -> dict:
+    return await get_fanart(client, 'movies', id)
 
 
 async def get_fanart_series(client: httpx.AsyncClient, id: str) -> dict:
+    return await get_fanart(client, 'tv', id)
+
+
+async def get_fanart(client: httpx.AsyncClient, kind: str, id: str) -> dict:
+    key = f"{kind}:{id}"
+    item = await fanart_cache.aget(key)
+    if item != None:
+        return item
+    return await coordination.single_flight(
+        f"fanart:{key}",
+        lambda: fetch_fanart(client, kind, id),
+        lambda: fanart_cache.aget(key),
+        persist=fanart_cache.aflush
+    )
+
+
+async def fetch_fanart(client: httpx.AsyncClient, kind: str, id: str) -> dict:
     params = {
         "api_key": FANART_API_KEY
     }
 
-    url = f"http://webservice.fanart.tv/v3/tv/{id}"
-    response = await client.get(url, params=params)
+    url = f"http://webservice.fanart.tv/v3/{kind}/{id}"
+    response = await breaker.get('fanart', client, url, params=params)
 
+    # Optional source, skipped (and not cached) when down
+    if response == None:
+        return {"error": "unavailable"}
     if response.status_code == 200:
-        return response.json()
+        data = response.json()
+        fanart_cache.set_later(f"{kind}:{id}", data)
+        return data
+    elif response.status_code == 404:
+        data = {"error": 404}
+        fanart_cache.set_later(f"{kind}:{id}", data, FANART_MISS_TTL)
+        return data
     else:
-        return {"error": response.status_code}
\ No newline at end of file
+        return {"error": response.status_code}
@@ -1,6 +1,7 @@
 from cache import Cache
 from datetime import timedelta
-from collections import defaultdict
+import coordination
+import freshness
 import httpx
 import os
 import asyncio
@@ -13,7 +14,11 @@ TMDB_POSTER_URL = 'https://image.tmdb.org/t/p/w500'
 TMDB_BACK_URL = 'https://image.tmdb.org/t/p/original'
 TMDB_API_KEY = os.getenv('TMDB_API_KEY')
 
-TMDB_SEMAPHORES = defaultdict(lambda: asyncio.Semaphore(50))
+# Concurrent requests per TMDB key (shared by all workers)
+TMDB_CONCURRENCY = 50
+# Max append_to_response items per call
+APPEND_LIMIT = 20
+SERIES_APPEND = ['external_ids', 'credits', 'videos', 'images']
 
 # Load languages
 with open("languages/languages.json", "r", encoding="utf-8") as f:
@@ -21,15 +26,18 @@ with open("languages/languages.json", "r", encoding="utf-8") as f:
 
 # Cache set
 tmp_cache = {}
+season_cache = {}
 def open_cache():
-    global tmp_cache
+    global tmp_cache, season_cache
     for language in LANGUAGES:
-        tmp_cache[language] = Cache(f"./cache/{language}/tmdb/tmp", timedelta(days=7).total_seconds())
+        tmp_cache[language] = Cache(f"./cache/{language}/tmdb/tmp", timedelta(days=7).total_seconds(), namespace='tmdb', language=language)
+        season_cache[language] = Cache(f"./cache/{language}/tmdb/seasons", timedelta(days=7).total_seconds(), namespace='seasons', language=language)
 
 def close_cache():
-    global tmp_cache
+    global tmp_cache, season_cache
     for language in tmp_cache:
         tmp_cache[language].close()
+        season_cache[language].close()
 
 def get_cache_lenght():
     global tmp_cache
@@ -45,27 +53,28 @@ async def fetch_and_retry(client: httpx.AsyncClient, id: str, url: str, language
         "accept": "application/json"
     }
     tmdb_api_key = params.get('api_key', None)
-    semaphore = TMDB_SEMAPHORES[tmdb_api_key]
-    async with semaphore:
-        for attempt in range(1, max_retries + 1):
+    semaphore = coordination.semaphore(f"tmdb:{tmdb_api_key}", TMDB_CONCURRENCY)
+    for attempt in range(1, max_retries + 1):
+        async with semaphore.hold():
             response = await client.get(url, headers=headers, params=params)
 
-            if response.status_code == 200:
-                meta_dict = response.json()
+        if response.status_code == 200:
+            meta_dict = response.json()
 
-                # Only imdb_id cache save
-                if 'tt' in str(id):
-                    meta_dict['imdb_id'] = id
-                    tmp_cache[language].set(id, meta_dict)
+            # Only imdb_id cache save
+            if 'tt' in str(id):
+                meta_dict['imdb_id'] = id
+                tmp_cache[language].set_later(id, meta_dict, freshness.find_ttl(meta_dict))
 
-                return meta_dict
+            return meta_dict
 
-            elif response.status_code == 429:
-                print(response)
-                await asyncio.sleep(1)#(attempt * 2)
+        elif response.status_code == 429:
+            print(response)
+            # Slot released while backing off
+            await asyncio.sleep(1)#(attempt * 2)
 
-            elif response.status_code == 401:
-                return {"error": "tmdb-key-error"}
+        elif response.status_code == 401:
+            return {"error": "tmdb-key-error"}
 
     print('TMDB failed fetch')
     return {}
@@ -80,14 +89,45 @@ async def get_tmdb_data(client: httpx.AsyncClient, id: str, source: str, languag
     }
 
     url = f"https://api.themoviedb.org/3/find/{id}"
-    item = tmp_cache[language].get(id)
+    item = await tmp_cache[language].aget(id)
 
     if item != None:
         return item
     else:
-        return await fetch_and_retry(client, id, url, language, params)
+        return await coordination.single_flight(
+            f"tmdb:{language}:{source}:{id}",
+            lambda: fetch_and_retry(client, id, url, language, params),
+            lambda: tmp_cache[language].aget(id),
+            persist=tmp_cache[language].aflush
+        )
     
 
+# Get many from external source ids: cached in one round trip, misses fetched in one batch
+async def get_tmdb_data_many(client: httpx.AsyncClient, ids: list, source: str, language: str, api_key: str) -> dict:
+    items = await tmp_cache[language].aget_many(ids)
+    misses = [id for id in dict.fromkeys(ids) if id != None and id not in items]
+    items.update(await fetch_tmdb_data_many(client, misses, source, language, api_key))
+    return items
+
+
+# Fetch not cached ids, stored by the write-behind batch
+async def fetch_tmdb_data_many(client: httpx.AsyncClient, ids: list, source: str, language: str, api_key: str) -> dict:
+    params = {
+        "external_source": source,
+        "language": language,
+        "api_key": api_key
+    }
+    tasks = []
+    for id in ids:
+        tasks.append(coordination.single_flight(
+            f"tmdb:{language}:{source}:{id}",
+            lambda id=id: fetch_and_retry(client, id, f"https://api.themoviedb.org/3/find/{id}", language, params),
+            lambda id=id: tmp_cache[language].aget(id),
+            persist=tmp_cache[language].aflush
+        ))
+    return dict(zip(ids, await asyncio.gather(*tasks)))
+
+
 # Get movie detail with cast video and images
 async def get_movie_details(client: httpx.AsyncClient, id: str, language: str, api_key: str) -> dict:
     params = {
@@ -101,11 +141,18 @@ async def get_movie_details(client: httpx.AsyncClient, id: str, language: str, a
 
 
 # Get series detail with cast video and images
-async def get_series_details(client: httpx.AsyncClient, id: str, language: str, api_key: str) -> dict:
+# The first seasons not in season cache are appended to the same call ('season/N' keys, missing seasons are omitted),
+# cached ones are checked against their fingerprint by get_seasons_details. No seasons when episodes come from elsewhere.
+async def get_series_details(client: httpx.AsyncClient, id: str, language: str, api_key: str, append_seasons: bool = True) -> dict:
+    seasons = []
+    if append_seasons:
+        numbers = range(APPEND_LIMIT - len(SERIES_APPEND))
+        cached = await season_cache[language].aget_many([f"{id}:{number}" for number in numbers])
+        seasons = [f"season/{number}" for number in numbers if f"{id}:{number}" not in cached]
     params = {
         "api_key": api_key,
         "language": language,
-        "append_to_response": "external_ids,credits,videos,images",
+        "append_to_response": ",".join(SERIES_APPEND + seasons),
         "include_image_language": f"{language},null"
     }
     url = f"https://api.themoviedb.org/3/tv/{id}"
@@ -113,7 +160,14 @@ async def get_series_details(client: httpx.AsyncClient, id: str, language: str,
 
 
 # Get series detail with cast video and images
-async def get_season_details(client: httpx.AsyncClient, season_id: str, season_number, language: str, api_key: str) -> dict:
+# With a fingerprint (from series details) an unchanged cached season is reused
+async def get_season_details(client: httpx.AsyncClient, season_id: str, season_number, language: str, api_key: str, fingerprint: list = None) -> dict:
+    key = f"{season_id}:{season_number}"
+    if fingerprint != None:
+        cached = await season_cache[language].aget(key)
+        if cached != None and cached['fingerprint'] == fingerprint:
+            return cached['data']
+
     params = {
         "language": language,
         "append_to_response": "external_ids",
@@ -121,12 +175,71 @@ async def get_season_details(client: httpx.AsyncClient, season_id: str, season_n
     }
 
     url = f"https://api.themoviedb.org/3/tv/{season_id}/season/{season_number}"
-    return await fetch_and_retry(client, season_id, url, language, params)
+    data = await fetch_and_retry(client, season_id, url, language, params)
+
+    if fingerprint != None and 'episodes' in data:
+        season_cache[language].set_later(key, {"fingerprint": fingerprint, "data": data})
+    return data
+
+# Get many seasons: from series details appends, from cache (unchanged fingerprint)
+# and the others in batched calls of APPEND_LIMIT seasons
+async def get_seasons_details(client: httpx.AsyncClient, series_id: str, seasons: list, language: str, api_key: str, series_data: dict = None) -> list:
+    """
+    `seasons` is a list of (season_number, fingerprint), the result keeps its order.
+    """
+    if series_data == None:
+        series_data = {}
+    found = {}
+    missing = []
+    to_cache = {}
+    for number, fingerprint in seasons:
+        if f"season/{number}" in series_data:
+            found[number] = series_data[f"season/{number}"]
+            # Not appended again to the next series details
+            if fingerprint != None and 'episodes' in found[number]:
+                to_cache[f"{series_id}:{number}"] = {"fingerprint": fingerprint, "data": found[number]}
+        else:
+            missing.append((number, fingerprint))
+
+    keys = [f"{series_id}:{number}" for number, fingerprint in missing if fingerprint != None]
+    cached = await season_cache[language].aget_many(keys)
+    to_fetch = []
+    for number, fingerprint in missing:
+        item = cached.get(f"{series_id}:{number}")
+        if item != None and item['fingerprint'] == fingerprint:
+            found[number] = item['data']
+        else:
+            to_fetch.append((number, fingerprint))
+
+    tasks = []
+    for i in range(0, len(to_fetch), APPEND_LIMIT):
+        params = {
+            "language": language,
+            "append_to_response": ",".join(f"season/{number}" for number, fingerprint in to_fetch[i:i + APPEND_LIMIT]),
+            "api_key": api_key
+        }
+        tasks.append(fetch_and_retry(client, series_id, f"https://api.themoviedb.org/3/tv/{series_id}", language, params))
+    fetched = {}
+    for data in await asyncio.gather(*tasks):
+        fetched.update(data)
+
+    for number, fingerprint in to_fetch:
+        data = fetched.get(f"season/{number}")
+        if data == None:
+            # Not in the batch (error), single season call
+            data = await get_season_details(client, series_id, number, language, api_key, fingerprint)
+        elif fingerprint != None and 'episodes' in data:
+            to_cache[f"{series_id}:{number}"] = {"fingerprint": fingerprint, "data": data}
+        found[number] = data
+    season_cache[language].set_many_later(to_cache)
+
+    return [found[number] for number, fingerprint in seasons]
+
 
 # Converting imdb id to tmdb id
 async def convert_imdb_to_tmdb(imdb_id: str, language: str, api_key: str) -> str:
 
-    tmdb_data = tmp_cache[language].get(imdb_id)
+    tmdb_data = await tmp_cache[language].aget(imdb_id)
 
     if tmdb_data != None:
         return get_id(tmdb_data)
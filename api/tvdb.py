@@ -25,7 +25,7 @@ with open("languages/lang_tvdb.json", "r", encoding="utf-8") as f:
 token_cache = None
 def open_cache():
     global token_cache
-    token_cache = Cache('./cache/tvdb/token', timedelta(days=29).total_seconds())
+    token_cache = Cache('./cache/tvdb/token', timedelta(days=29).total_seconds(), namespace='tvdb')
 
 def close_cache():
     global token_cache
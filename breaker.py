@@ -0,0 +1,153 @@
+from collections import deque
+import asyncio
+import httpx
+import time
+import os
+
+# Calls kept to compute the error rate
+WINDOW_SIZE = 20
+# Calls needed before the breaker can open
+MIN_CALLS = 5
+# Error (or slow call) rate that opens the breaker
+FAILURE_RATE = 0.5
+# Seconds an open breaker rejects calls before a probe is let through
+OPEN_TIME = 30
+# Wait before sending the same request to the next mirror (seconds)
+HEDGE_DELAY = float(os.getenv('HEDGE_DELAY', 1.5))
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker():
+    """
+    Per upstream breaker (per worker): opens when too many of the last calls
+    failed or were slower than `slow_call`, then lets a single probe through
+    every OPEN_TIME seconds until one succeeds.
+    """
+
+    def __init__(self, name: str, timeout: float, slow_call: float):
+        self.name = name
+        self.timeout = timeout
+        self.slow_call = slow_call
+        self.calls = deque(maxlen=WINDOW_SIZE)
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at == None:
+            return 'closed'
+        if self.probing or time.time() - self.opened_at >= OPEN_TIME:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record(self, ok: bool, elapsed: float):
+        ok = ok and elapsed < self.slow_call
+        if self.opened_at != None:
+            # Probe result
+            self.probing = False
+            if ok:
+                self.opened_at = None
+                self.calls.clear()
+            else:
+                self.opened_at = time.time()
+            return
+
+        self.calls.append(ok)
+        failures = self.calls.count(False)
+        if len(self.calls) >= MIN_CALLS and failures / len(self.calls) >= FAILURE_RATE:
+            print(f"Circuit {self.name} open")
+            self.opened_at = time.time()
+
+    async def get(self, client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+        """
+        GET through the breaker with the upstream timeout.
+        Raises CircuitOpen when the upstream is skipped, httpx errors are recorded and raised.
+        """
+        if not self.allow():
+            raise CircuitOpen(self.name)
+        start = time.time()
+        try:
+            response = await client.get(url, timeout=self.timeout, **kwargs)
+        except httpx.HTTPError:
+            self.record(False, time.time() - start)
+            raise
+        except asyncio.CancelledError:
+            # Lost hedge, not an upstream failure
+            self.probing = False
+            raise
+        self.record(response.status_code < 500 and response.status_code != 429, time.time() - start)
+        return response
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "calls": len(self.calls),
+            "failures": self.calls.count(False)
+        }
+
+
+breakers = {
+    'cinemeta': CircuitBreaker('cinemeta', timeout=10, slow_call=5),
+    'fanart': CircuitBreaker('fanart', timeout=5, slow_call=3),
+    'lingva': CircuitBreaker('lingva', timeout=10, slow_call=5)
+}
+
+# Other upstreams (kitsu addons, TMDB addon mirrors) are keyed by base url
+def get_breaker(name: str) -> CircuitBreaker:
+    if name not in breakers:
+        breakers[name] = CircuitBreaker(name, timeout=15, slow_call=8)
+    return breakers[name]
+
+
+async def get(name: str, client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response | None:
+    """
+    GET an optional upstream: None when the breaker is open or the call failed.
+    """
+    try:
+        return await get_breaker(name).get(client, url, **kwargs)
+    except (CircuitOpen, httpx.HTTPError):
+        return None
+
+
+async def hedged_get(client: httpx.AsyncClient, mirrors: list, path: str, delay: float = HEDGE_DELAY) -> tuple[int, httpx.Response | None]:
+    """
+    GET the same path from mirrors (in the given order): the next mirror is tried when the
+    previous fails or is still pending after `delay`. First 200 wins, the others are cancelled.
+    Returns (mirror index, response), response is None when all mirrors failed.
+    """
+    candidates = [(index, mirror) for index, mirror in enumerate(mirrors) if get_breaker(mirror).state != 'open']
+    if not candidates:
+        candidates = list(enumerate(mirrors))
+
+    pending = {}
+    last = (candidates[0][0], None)
+    try:
+        while candidates or pending:
+            if candidates:
+                index, mirror = candidates.pop(0)
+                task = asyncio.create_task(get_breaker(mirror).get(client, f"{mirror}{path}"))
+                pending[task] = index
+            done, _ = await asyncio.wait(pending, timeout=delay if candidates else None, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = pending.pop(task)
+                if task.exception() == None:
+                    response = task.result()
+                    last = (index, response)
+                    if response.status_code == 200:
+                        return last
+        return last
+    finally:
+        for task in pending:
+            task.cancel()
@@ -1,35 +1,813 @@
 from diskcache import Cache as diskCache
-#from cachetools import TTLCache
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import codec
+import copy
+import ast
+import math
+import asyncio
+import pickle
+import time
+import zlib
+import os
 
-class Cache():
+try:
+    import redis
+except ImportError:
+    redis = None
 
-    def __init__(self, dir: str, expires: int = None):
-        self.cache = diskCache(dir, sqlite_cache_size=50000, disk_min_file_size=0, eviction_policy='least-recently-stored')
-        self.expires = expires
+# Backend selection
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'disk') # disk | redis
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_PREFIX = os.getenv('REDIS_PREFIX', 'toast')
+# Local near-cache in front of redis
+NEAR_CACHE_SIZE = int(os.getenv('NEAR_CACHE_SIZE', 2000))
+NEAR_CACHE_TTL = int(os.getenv('NEAR_CACHE_TTL', 60))
+# Values bigger than this are compressed in redis
+COMPRESS_MIN_SIZE = 512
+# Threads for cache I/O used by async handlers
+CACHE_THREADS = int(os.getenv('CACHE_THREADS', 4))
+# Write-behind batching window (seconds)
+WRITE_BEHIND_INTERVAL = 0.05
+# Global disk budget (bytes) split across namespaces by weight
+CACHE_SIZE_BUDGET = int(os.getenv('CACHE_SIZE_BUDGET', 4 * 2**30))
+EVICTION_POLICY = 'least-frequently-used'
+DEFAULT_WEIGHTS = {
+    'tmdb': 3,
+    'seasons': 2,
+    'meta': 3,
+    'episodes': 3,
+    'meta-core': 1,
+    'episodes-core': 2,
+    'translation': 1,
+    'translation-source': 0.5,
+    'upstream': 1,
+    'fanart': 0.5,
+    'kitsu': 0.5,
+    'mal': 0.5
+}
+
+# Opened caches by directory
+open_caches = {}
+
+
+class DiskBackend():
+    """
+    Local diskcache (SQLite) backend.
+    """
 
-    def set(self, key, value):
-        self.cache.set(key, value, expire=self.expires)
+    def __init__(self, dir: str):
+        # Incremental auto vacuum: free pages are given back by maintenance
+        self.cache = diskCache(dir, sqlite_cache_size=50000, disk_min_file_size=0, eviction_policy=EVICTION_POLICY, sqlite_auto_vacuum=2)
+        # Legacy auto vacuum mode already logged
+        self.legacy_vacuum = False
 
     def get(self, key, default=None):
         return self.cache.get(key, default)
-    
-    def get_len(self):
-        return len(self)
-    
+
+    def get_many(self, keys: list, batch: int = 500) -> dict:
+        """
+        One SELECT per `batch` keys instead of one per key.
+        """
+        result = {}
+        disk = self.cache._disk
+        select = 'SELECT rowid, key, raw, expire_time, mode, filename, value FROM Cache WHERE key IN (%s)'
+        # Hits count for LFU eviction, as Cache.get does
+        update = 'UPDATE Cache SET access_count = access_count + 1 WHERE rowid IN (%s)'
+
+        for start in range(0, len(keys), batch):
+            db_keys = {}
+            for key in keys[start:start + batch]:
+                db_key, raw = disk.put(key)
+                db_keys[(normalize_db_key(db_key), bool(raw))] = key
+
+            now = time.time()
+            hits = []
+            rows = self.cache._sql(select % ','.join('?' * len(db_keys)), [db_key for db_key, raw in db_keys]).fetchall()
+            for rowid, db_key, raw, expire_time, mode, filename, value in rows:
+                key = db_keys.get((normalize_db_key(db_key), bool(raw)))
+                if key == None or (expire_time != None and expire_time < now):
+                    continue
+                try:
+                    result[key] = disk.fetch(mode, filename, value, False)
+                    hits.append(rowid)
+                except IOError:
+                    # Value file removed by a concurrent delete
+                    continue
+            if hits and self.cache.eviction_policy == 'least-frequently-used':
+                self.cache._sql(update % ','.join('?' * len(hits)), hits)
+        return result
+
+    def set(self, key, value, expire: float = None):
+        self.cache.set(key, value, expire=expire)
+
+    def set_many(self, items: dict, expire: float = None):
+        """
+        All writes in a single transaction (one commit / fsync).
+        """
+        with self.cache.transact():
+            for key, value in items.items():
+                self.cache.set(key, value, expire=expire)
+
+    def delete(self, key) -> bool:
+        return self.cache.delete(key)
+
+    def touch_many(self, keys: list, expire: float = None) -> list:
+        missing = []
+        with self.cache.transact():
+            for key in keys:
+                if not self.cache.touch(key, expire=expire):
+                    missing.append(key)
+        return missing
+
     def clear(self):
         return self.cache.clear()
 
     def expire(self):
         return self.cache.expire()
-    
+
     def close(self):
         return self.cache.close()
-    
-    def __len__(self):
+
+    def count(self) -> int:
         return len(self.cache)
-    
+
+    def volume(self) -> int:
+        return self.cache.volume()
+
+    def set_size_limit(self, size_limit: int):
+        if self.cache.size_limit != size_limit:
+            self.cache.reset('size_limit', size_limit)
+
+    def size_limit(self) -> int:
+        return self.cache.size_limit
+
+    # Maintenance steps, each one short transaction
+    def expire_batch(self, now: float, batch: int = 100) -> int:
+        """
+        Remove up to `batch` items expired before `now`.
+        """
+        select = (
+            'SELECT rowid, expire_time, filename FROM Cache'
+            ' WHERE ? < expire_time AND expire_time < ? ORDER BY expire_time LIMIT ?'
+        )
+        with self.cache._transact(retry=True) as (sql, cleanup):
+            rows = sql(select, (0, now, batch)).fetchall()
+            if rows:
+                sql('DELETE FROM Cache WHERE rowid IN (%s)' % ','.join(str(row[0]) for row in rows))
+            for row in rows:
+                cleanup(row[-1])
+        return len(rows)
+
+    def cull(self) -> int:
+        # Evict by policy until under the size limit
+        return self.cache.cull(retry=True)
+
+    def vacuum_step(self, pages: int, min_free: float) -> int:
+        """
+        Give back up to `pages` free pages when they are more than `min_free` of the file.
+        Files created before incremental auto vacuum are skipped: a full VACUUM blocks
+        the cache, it is left to an offline run (logged once).
+        Returns the pages released (0 = nothing to do).
+        """
+        sql = self.cache._sql
+        page_count = sql('PRAGMA page_count').fetchone()[0]
+        free = sql('PRAGMA freelist_count').fetchone()[0]
+        if page_count == 0 or free / page_count < min_free:
+            return 0
+        if sql('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            if not self.legacy_vacuum:
+                self.legacy_vacuum = True
+                print(f"Cache {self.cache.directory}: {free} free pages, no incremental auto vacuum (run VACUUM offline)")
+            return 0
+        # executescript steps the pragma to completion (execute frees one page)
+        self.cache._con.executescript('PRAGMA incremental_vacuum(%d)' % pages)
+        return min(free, pages)
+
+    def iter_records(self, since: float = 0, batch: int = 100):
+        """
+        Yield (key, value, store_time, expire_time) for every live item stored after `since`.
+        Reads in small batches ordered by rowid, so concurrent writes are not blocked.
+        Values are read as they are, without counting a hit (no write, LFU counts untouched).
+        """
+        select = (
+            'SELECT rowid, key, raw, store_time, expire_time, mode, filename, value FROM Cache'
+            ' WHERE rowid > ? AND store_time >= ? ORDER BY rowid LIMIT ?'
+        )
+        disk = self.cache._disk
+        last_rowid = 0
+        while True:
+            rows = self.cache._sql(select, (last_rowid, since, batch)).fetchall()
+            if not rows:
+                break
+            now = time.time()
+            for rowid, db_key, raw, store_time, expire_time, mode, filename, value in rows:
+                last_rowid = rowid
+                if expire_time != None and expire_time < now:
+                    continue
+                try:
+                    value = disk.fetch(mode, filename, value, False)
+                except IOError:
+                    # Value file removed by a concurrent delete
+                    continue
+                if value != None:
+                    yield disk.get(db_key, raw), value, store_time, expire_time
+
+    def get_records(self, keys: list, batch: int = 100):
+        """
+        Yield (key, value, store_time, expire_time) for the live `keys`, read like iter_records.
+        """
+        select = 'SELECT key, raw, store_time, expire_time, mode, filename, value FROM Cache WHERE key IN (%s)'
+        disk = self.cache._disk
+        for start in range(0, len(keys), batch):
+            db_keys = {}
+            for key in keys[start:start + batch]:
+                db_key, raw = disk.put(key)
+                db_keys[(normalize_db_key(db_key), bool(raw))] = key
+
+            now = time.time()
+            rows = self.cache._sql(select % ','.join('?' * len(db_keys)), [db_key for db_key, raw in db_keys]).fetchall()
+            for db_key, raw, store_time, expire_time, mode, filename, value in rows:
+                key = db_keys.get((normalize_db_key(db_key), bool(raw)))
+                if key == None or (expire_time != None and expire_time < now):
+                    continue
+                try:
+                    value = disk.fetch(mode, filename, value, False)
+                except IOError:
+                    continue
+                if value != None:
+                    yield key, value, store_time, expire_time
+
+    def set_records(self, records: list) -> int:
+        count = 0
+        now = time.time()
+        with self.cache.transact():
+            for key, value, expire_time in records:
+                if expire_time != None and expire_time <= now:
+                    continue
+                self.cache.set(key, value, expire=expire_time - now if expire_time != None else None)
+                count += 1
+        return count
+
+
+def normalize_db_key(db_key):
+    # Binary keys are returned as bytes by SQLite
+    if isinstance(db_key, memoryview):
+        return bytes(db_key)
+    return db_key
+
+
+class NearCache(TTLCache):
+    """
+    Thread safe TTLCache (backends are used from the cache thread pool).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            return super().get(key, default)
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            super().__setitem__(key, value)
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+
+
+redis_client = None
+def get_redis_client():
+    global redis_client
+    if redis == None:
+        raise RuntimeError("CACHE_BACKEND=redis requires the redis package")
+    if redis_client == None:
+        redis_client = redis.Redis.from_url(REDIS_URL)
+    return redis_client
+
+
+class RedisBackend():
+    """
+    Redis / KeyDB backend shared by all replicas.
+    Values are pickled with their store time, compressed when large,
+    and kept for a few seconds in a local LRU near-cache.
+    The near-cache holds serialized values, so callers never share (and mutate) the same object.
+    """
+
+    def __init__(self, dir: str, client=None):
+        self.prefix = f"{REDIS_PREFIX}:{dir.removeprefix('./cache/')}:"
+        self.client = client if client != None else get_redis_client()
+        self.near_cache = NearCache(maxsize=NEAR_CACHE_SIZE, ttl=NEAR_CACHE_TTL)
+
+    def make_key(self, key) -> str:
+        # repr keeps the key type: 5, '5' and (5,) are different keys
+        return self.prefix + repr(key)
+
+    def parse_key(self, name: bytes):
+        return ast.literal_eval(name.decode('utf-8').removeprefix(self.prefix))
+
+    @staticmethod
+    def expire_ms(expire: float) -> int | None:
+        # Milliseconds, rounded up: int(0.5) seconds would be 0 (rejected by redis)
+        return max(1, math.ceil(expire * 1000)) if expire else None
+
+    @staticmethod
+    def dumps(value, store_time: float) -> bytes:
+        data = pickle.dumps((store_time, value), protocol=pickle.HIGHEST_PROTOCOL)
+        # Values encoded by the cache codec are already compressed
+        if len(data) >= COMPRESS_MIN_SIZE and not isinstance(value, bytes):
+            return b'z' + zlib.compress(data)
+        return b'p' + data
+
+    @staticmethod
+    def loads(data: bytes):
+        if data[:1] == b'z':
+            return pickle.loads(zlib.decompress(data[1:]))
+        return pickle.loads(data[1:])
+
+    def get(self, key, default=None):
+        data = self.near_cache.get(key)
+        if data == None:
+            data = self.client.get(self.make_key(key))
+            if data == None:
+                return default
+            self.near_cache[key] = data
+        return self.loads(data)[1]
+
+    def get_many(self, keys: list) -> dict:
+        result = {}
+        missing = []
+        for key in keys:
+            data = self.near_cache.get(key)
+            if data != None:
+                result[key] = self.loads(data)[1]
+            else:
+                missing.append(key)
+
+        if missing:
+            # Single round trip
+            values = self.client.mget([self.make_key(key) for key in missing])
+            for key, data in zip(missing, values):
+                if data != None:
+                    self.near_cache[key] = data
+                    result[key] = self.loads(data)[1]
+        return result
+
+    def set(self, key, value, expire: float = None):
+        data = self.dumps(value, time.time())
+        self.client.set(self.make_key(key), data, px=self.expire_ms(expire))
+        self.near_cache[key] = data
+
+    def set_many(self, items: dict, expire: float = None):
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in items.items():
+            data = self.dumps(value, now)
+            pipe.set(self.make_key(key), data, px=self.expire_ms(expire))
+            self.near_cache[key] = data
+        pipe.execute()
+
+    def delete(self, key) -> bool:
+        self.near_cache.pop(key, None)
+        return self.client.delete(self.make_key(key)) > 0
+
+    def touch_many(self, keys: list, expire: float = None) -> list:
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            if expire:
+                pipe.pexpire(self.make_key(key), self.expire_ms(expire))
+            else:
+                pipe.exists(self.make_key(key))
+        return [key for key, found in zip(keys, pipe.execute()) if not found]
+
+    def clear(self):
+        count = 0
+        self.near_cache.clear()
+        for keys in self.scan_batches():
+            count += self.client.delete(*keys)
+        return count
+
+    def expire(self):
+        # Redis expires keys by itself
+        return 0
+
+    def close(self):
+        self.near_cache.clear()
+
+    def count(self) -> int:
+        return sum(len(keys) for keys in self.scan_batches())
+
+    # Memory limits and LFU eviction are redis server settings (maxmemory, allkeys-lfu)
+    def volume(self) -> None:
+        return None
+
+    def set_size_limit(self, size_limit: int):
+        pass
+
+    def size_limit(self) -> None:
+        return None
+
+    def expire_batch(self, now: float, batch: int = 100) -> int:
+        return 0
+
+    def cull(self) -> int:
+        return 0
+
+    def vacuum_step(self, pages: int, min_free: float) -> int:
+        return 0
+
+    def scan_batches(self, batch: int = 500):
+        keys = []
+        for key in self.client.scan_iter(match=self.prefix + '*', count=batch):
+            keys.append(key)
+            if len(keys) >= batch:
+                yield keys
+                keys = []
+        if keys:
+            yield keys
+
+    def iter_records(self, since: float = 0, batch: int = 100):
+        now = time.time()
+        for keys in self.scan_batches(batch):
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipe.get(key)
+                pipe.pttl(key)
+            results = pipe.execute()
+            for i, key in enumerate(keys):
+                data, ttl = results[2 * i], results[2 * i + 1]
+                if data == None:
+                    continue
+                store_time, value = self.loads(data)
+                if store_time < since:
+                    continue
+                try:
+                    key = self.parse_key(key)
+                except (ValueError, SyntaxError):
+                    # Keys stored before the typed encoding
+                    continue
+                expire_time = now + ttl / 1000 if ttl > 0 else None
+                yield key, value, store_time, expire_time
+
+    def get_records(self, keys: list, batch: int = 100):
+        now = time.time()
+        for start in range(0, len(keys), batch):
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys[start:start + batch]:
+                pipe.get(self.make_key(key))
+                pipe.pttl(self.make_key(key))
+            results = pipe.execute()
+            for i, key in enumerate(keys[start:start + batch]):
+                data, ttl = results[2 * i], results[2 * i + 1]
+                if data == None:
+                    continue
+                store_time, value = self.loads(data)
+                yield key, value, store_time, now + ttl / 1000 if ttl > 0 else None
+
+    def set_records(self, records: list) -> int:
+        count = 0
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        for key, value, expire_time in records:
+            if expire_time != None and expire_time <= now:
+                continue
+            expire = self.expire_ms(expire_time - now) if expire_time != None else None
+            pipe.set(self.make_key(key), self.dumps(value, now), px=expire)
+            count += 1
+        pipe.execute()
+        return count
+
+
+def make_backend(dir: str):
+    if CACHE_BACKEND == 'redis':
+        return RedisBackend(dir)
+    return DiskBackend(dir)
+
+
+executor = ThreadPoolExecutor(max_workers=CACHE_THREADS, thread_name_prefix='cache')
+
+async def run_in_pool(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+
+class WriteBehind():
+    """
+    Background thread writing the pending values of every cache,
+    one batch (transaction) per cache every WRITE_BEHIND_INTERVAL.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.thread = None
+
+    def schedule(self, cache):
+        with self.lock:
+            self.dirty.add(cache)
+            if self.thread == None:
+                self.thread = threading.Thread(target=self.run, name='cache-write-behind', daemon=True)
+                self.thread.start()
+        self.event.set()
+
+    def run(self):
+        while True:
+            self.event.wait()
+            # Collect more writes in the same batch
+            time.sleep(self.interval)
+            self.event.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+        for cache in dirty:
+            cache.flush()
+
+
+write_behind = WriteBehind(WRITE_BEHIND_INTERVAL)
+
+
+class Cache():
+
+    def __init__(self, dir: str, expires: int = None, namespace: str = None, language: str = None, backend=None):
+        self.backend = backend if backend != None else make_backend(dir)
+        self.expires = expires
+        self.dir = dir
+        self.namespace = namespace
+        self.language = language
+        # Write-behind values not yet stored, and their own TTL when not the default one
+        self.pending = {}
+        self.pending_expires = {}
+        self.pending_lock = threading.Lock()
+        # Compressed values (None = stored as they are)
+        self.codec = codec.get_codec(namespace)
+        open_caches[dir] = self
+
+    def encode(self, value):
+        return self.codec.encode(value) if self.codec != None else value
+
+    def decode(self, value, default=None):
+        return self.codec.decode(value, default) if self.codec != None else value
+
+    def set(self, key, value, expire: float = None):
+        self.backend.set(key, self.encode(value), expire=expire if expire != None else self.expires)
+
+    def get(self, key, default=None):
+        found, value = self.get_pending(key)
+        if found:
+            return value
+        # Flush removes pending values only once stored: not pending means readable here
+        return self.decode(self.backend.get(key, default), default)
+
+    def get_pending(self, key) -> tuple:
+        # (found, copy of the queued value): callers never share the object being written
+        with self.pending_lock:
+            if key in self.pending:
+                return True, copy.deepcopy(self.pending[key])
+        return False, None
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Return {key: value} for the cached keys, missing keys are left out.
+        """
+        keys = [key for key in dict.fromkeys(keys) if key != None]
+        if not keys:
+            return {}
+        result = self.backend.get_many(keys)
+        if self.codec != None:
+            result = {key: self.decode(value) for key, value in result.items()}
+            # Unreadable values (removed dictionary) are misses
+            result = {key: value for key, value in result.items() if value != None}
+        if self.pending:
+            with self.pending_lock:
+                for key in keys:
+                    if key in self.pending:
+                        result[key] = copy.deepcopy(self.pending[key])
+        return result
+
+    def delete(self, key) -> bool:
+        with self.pending_lock:
+            self.pending.pop(key, None)
+            self.pending_expires.pop(key, None)
+        return self.backend.delete(key)
+
+    # Async facade: disk I/O on the cache thread pool, writes queued
+    async def aget(self, key, default=None):
+        found, value = self.get_pending(key)
+        if found:
+            return value
+        return await run_in_pool(self.get, key, default)
+
+    async def aget_many(self, keys: list) -> dict:
+        return await run_in_pool(self.get_many, keys)
+
+    def set_later(self, key, value, expire: float = None):
+        """
+        Queue the write, it is stored by the write-behind thread.
+        """
+        self.set_many_later({key: value}, expire)
+
+    def set_many_later(self, items: dict, expire: float = None):
+        if not items:
+            return
+        with self.pending_lock:
+            self.pending.update(items)
+            for key in items:
+                if expire != None:
+                    self.pending_expires[key] = expire
+                else:
+                    self.pending_expires.pop(key, None)
+        write_behind.schedule(self)
+
+    async def aflush(self):
+        """
+        Store the pending values now (on the cache thread pool).
+        """
+        if self.pending:
+            await run_in_pool(self.flush)
+
+    def flush(self):
+        with self.pending_lock:
+            items = dict(self.pending)
+            expires = dict(self.pending_expires)
+        if not items:
+            return
+        # One batch per TTL
+        batches = {}
+        for key, value in items.items():
+            batches.setdefault(expires.get(key, self.expires), {})[key] = self.encode(value)
+        try:
+            for expire, batch in batches.items():
+                self.backend.set_many(batch, expire=expire)
+        except Exception as e:
+            print(f"Cache write-behind failed on {self.dir}: {e}")
+        with self.pending_lock:
+            for key, value in items.items():
+                if self.pending.get(key) is value:
+                    del self.pending[key]
+                    self.pending_expires.pop(key, None)
+
+    def set_many(self, items: dict, expire: float = None):
+        if items:
+            self.backend.set_many({key: self.encode(value) for key, value in items.items()}, expire=expire if expire != None else self.expires)
+
+    def touch_many(self, keys: list, expire: float = None) -> list:
+        """
+        Renew TTL without rewriting values, return the keys no longer cached.
+        """
+        if not keys:
+            return []
+        return self.backend.touch_many(keys, expire=expire if expire != None else self.expires)
+
+    def get_len(self):
+        return len(self)
+
+    def clear(self):
+        return self.backend.clear()
+
+    def expire(self):
+        return self.backend.expire()
+
+    def close(self):
+        if open_caches.get(self.dir) is self:
+            del open_caches[self.dir]
+        self.flush()
+        return self.backend.close()
+
+    def iter_records(self, since: float = 0, batch: int = 100):
+        # Exported values are decoded, dictionaries are not shared between instances
+        for key, value, store_time, expire_time in self.backend.iter_records(since, batch):
+            value = self.decode(value)
+            if value != None:
+                yield key, value, store_time, expire_time
+
+    def get_records(self, keys: list, batch: int = 100):
+        for key, value, store_time, expire_time in self.backend.get_records(keys, batch):
+            value = self.decode(value)
+            if value != None:
+                yield key, value, store_time, expire_time
+
+    def set_records(self, records: list) -> int:
+        """
+        Merge (key, value, expire_time) records, keeping remaining TTL.
+        """
+        return self.backend.set_records([(key, self.encode(value), expire_time) for key, value, expire_time in records])
+
+    def __len__(self):
+        return self.backend.count()
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
+
+
+def iter_caches(namespace: str = None, language: str = None) -> list[Cache]:
+    caches = []
+    for cache in list(open_caches.values()):
+        if namespace != None and cache.namespace != namespace:
+            continue
+        if language != None and cache.language != language:
+            continue
+        caches.append(cache)
+    return caches
+
+
+# Disk quotas
+# Unknown CACHE_WEIGHTS namespaces already logged
+unknown_weights = set()
+def load_weights() -> dict:
+    """
+    Namespace weights, overridden by CACHE_WEIGHTS (e.g. "meta=4,translation=0.5").
+    """
+    weights = dict(DEFAULT_WEIGHTS)
+    known = set(DEFAULT_WEIGHTS) | {cache.namespace for cache in iter_caches()}
+    for item in os.getenv('CACHE_WEIGHTS', '').split(','):
+        namespace, separator, weight = item.partition('=')
+        namespace = namespace.strip()
+        if not separator:
+            continue
+        if namespace not in known and namespace not in unknown_weights:
+            unknown_weights.add(namespace)
+            print(f"CACHE_WEIGHTS: unknown cache namespace '{namespace}' (known: {', '.join(sorted(filter(None, known)))})")
+        weights[namespace] = float(weight)
+    return weights
+
+
+def apply_quotas(budget: int = CACHE_SIZE_BUDGET) -> dict:
+    """
+    Split the budget across namespaces by weight, then across the stores of each
+    namespace by current volume (every store keeps a minimum share).
+    Returns {dir: size_limit}.
+    """
+    weights = load_weights()
+    namespaces = {}
+    for cache in iter_caches():
+        if cache.namespace in weights:
+            namespaces.setdefault(cache.namespace, []).append(cache)
+
+    total_weight = sum(weights[namespace] for namespace in namespaces)
+    limits = {}
+    for namespace, caches in namespaces.items():
+        quota = budget * weights[namespace] / total_weight
+        volumes = [cache.backend.volume() or 0 for cache in caches]
+        # Limits add up to the quota, stores in use get a bigger slice
+        share = quota / len(caches)
+        total = sum(volumes)
+        for cache, volume in zip(caches, volumes):
+            limit = int(quota * (volume + share) / (total + quota))
+            cache.backend.set_size_limit(limit)
+            limits[cache.dir] = limit
+    return limits
+
+
+def usage_report() -> dict:
+    weights = load_weights()
+    report = {}
+    for cache in iter_caches():
+        namespace = cache.namespace or 'other'
+        usage = report.setdefault(namespace, {"weight": weights.get(namespace), "stores": 0, "entries": 0, "size": 0, "limit": 0})
+        usage['stores'] += 1
+        usage['entries'] += cache.get_len()
+        usage['size'] += cache.backend.volume() or 0
+        usage['limit'] += cache.backend.size_limit() or 0
+    return report
+
+
+# Codec dictionaries
+def train_dictionaries(force: bool = False) -> dict:
+    """
+    Train a zstd dictionary for every codec namespace from its stored values.
+    Without `force` only namespaces still without a dictionary are trained.
+    Returns {namespace: new dictionary id}.
+    """
+    trained = {}
+    namespaces = {}
+    for cache in iter_caches():
+        if cache.codec != None and (force or cache.codec.version == 0):
+            namespaces.setdefault(cache.namespace, []).append(cache)
+
+    for namespace, caches in namespaces.items():
+        samples = []
+        for cache in caches:
+            for key, value, store_time, expire_time in cache.iter_records():
+                samples.append(value)
+                if len(samples) >= codec.TRAIN_SAMPLES:
+                    break
+            if len(samples) >= codec.TRAIN_SAMPLES:
+                break
+        try:
+            version = codec.train(namespace, samples)
+        except Exception as e:
+            print(f"Dictionary training failed for {namespace}: {e}")
+            continue
+        if version != None:
+            trained[namespace] = version
+    return trained
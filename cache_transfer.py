@@ -0,0 +1,137 @@
+from cache import iter_caches, open_caches
+import meta_store
+import json
+import zlib
+
+# Records merged per transaction on import
+IMPORT_BATCH = 500
+# Gzip output chunk size
+EXPORT_CHUNK = 64 * 1024
+
+
+def export_records(namespace: str = None, language: str = None, since: float = 0):
+    """
+    Gzip compressed NDJSON generator, one cache record per line.
+    Meta records come with the shared core and season records they point to,
+    so filtered exports (namespace, language, since) can be imported on their own.
+    Sync generator: Starlette iterates it in the threadpool, off the event loop.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    buffer = []
+    buffer_size = 0
+
+    for cache, (key, value, store_time, expire_time) in iter_export(namespace, language, since):
+        try:
+            line = json.dumps({
+                "dir": cache.dir,
+                "namespace": cache.namespace,
+                "language": cache.language,
+                "key": key,
+                "value": value,
+                "store_time": store_time,
+                "expire_time": expire_time
+            }, ensure_ascii=False) + '\n'
+        except (TypeError, ValueError):
+            continue
+
+        buffer.append(line.encode('utf-8'))
+        buffer_size += len(buffer[-1])
+        if buffer_size >= EXPORT_CHUNK:
+            chunk = compressor.compress(b''.join(buffer))
+            buffer, buffer_size = [], 0
+            if chunk:
+                yield chunk
+
+    if buffer:
+        yield compressor.compress(b''.join(buffer))
+    yield compressor.flush()
+
+
+def iter_export(namespace: str = None, language: str = None, since: float = 0):
+    """
+    Yield (cache, record) of the selected caches, then the records they depend on not exported yet.
+    """
+    # Exported keys of the namespaces records can depend on, dir -> keys
+    exported = {}
+    # Needed records, dir -> (cache, keys)
+    dependencies = {}
+    for cache in iter_caches(namespace, language):
+        for record in cache.iter_records(since):
+            if cache.namespace in meta_store.DEPENDENCY_NAMESPACES:
+                exported.setdefault(cache.dir, set()).add(record[0])
+            for dependency, key in meta_store.record_dependencies(cache, record[0], record[1]):
+                dependencies.setdefault(dependency.dir, (dependency, set()))[1].add(key)
+            yield cache, record
+
+    # Other namespace or language, or older than `since` (only renewed)
+    for dir, (cache, keys) in dependencies.items():
+        missing = [key for key in keys if key not in exported.get(dir, ())]
+        for record in cache.get_records(missing):
+            yield cache, record
+
+
+class RecordImporter():
+    """
+    Incremental NDJSON (optionally gzip) parser that merges records into live caches.
+    Feed raw chunks, then flush the pending batches.
+    """
+
+    def __init__(self):
+        self.decompressor = None
+        self.pending = b''
+        self.batches = {}
+        self.imported = 0
+        self.skipped = 0
+
+    def feed(self, chunk: bytes) -> list:
+        """
+        Parse a raw chunk and return the list of batches ready to be written.
+        """
+        if self.decompressor == None:
+            # Gzip magic number
+            is_gzip = chunk[:2] == b'\x1f\x8b'
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if is_gzip else False
+        if self.decompressor:
+            chunk = self.decompressor.decompress(chunk)
+
+        lines = (self.pending + chunk).split(b'\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.parse_line(line)
+
+        return self.pop_batches(full_only=True)
+
+    def finish(self) -> list:
+        if self.decompressor:
+            self.pending += self.decompressor.flush()
+        if self.pending:
+            self.parse_line(self.pending)
+            self.pending = b''
+        return self.pop_batches(full_only=False)
+
+    def parse_line(self, line: bytes):
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+            self.batches.setdefault(record['dir'], []).append((record['key'], record['value'], record.get('expire_time')))
+        except (ValueError, KeyError):
+            self.skipped += 1
+
+    def pop_batches(self, full_only: bool) -> list:
+        ready = []
+        for dir in list(self.batches):
+            if not full_only or len(self.batches[dir]) >= IMPORT_BATCH:
+                ready.append((dir, self.batches.pop(dir)))
+        return ready
+
+    def write(self, batches: list):
+        """
+        Blocking write, run it in a thread.
+        """
+        for dir, records in batches:
+            cache = open_caches.get(dir)
+            if cache == None:
+                self.skipped += len(records)
+                continue
+            self.imported += cache.set_records(records)
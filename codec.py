@@ -0,0 +1,164 @@
+import threading
+import hashlib
+import pickle
+import time
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Namespaces stored compressed (JSON-like dicts with repeated keys and urls)
+CODEC_NAMESPACES = [namespace for namespace in os.getenv('CODEC_NAMESPACES', 'meta,episodes,meta-core,episodes-core,tmdb,seasons,upstream,fanart').split(',') if namespace]
+# Smaller values are stored as they are
+CODEC_MIN_SIZE = 256
+ZSTD_LEVEL = 3
+DICT_SIZE = 64 * 1024
+TRAIN_SAMPLES = 2000
+# Values needed before a dictionary is trained
+TRAIN_MIN_SAMPLES = 200
+
+# Encoded value: MAGIC + dictionary id (8 bytes, 0 = no dictionary) + zstd frame
+MAGIC = b'\x00tz2'
+# Values of older formats (per worker dictionary versions) are cache misses
+LEGACY_MAGIC = b'\x00tz'
+
+# Trained dictionaries, in the backend of the values (shared by all workers and replicas):
+# (namespace, id) -> bytes, namespace -> current id. The id is a hash of the dictionary content.
+store = None
+store_lock = threading.Lock()
+def get_store():
+    global store
+    with store_lock:
+        if store == None:
+            # cache imports codec
+            from cache import make_backend
+            store = make_backend('./cache/shared/dictionaries')
+        return store
+
+def close_store():
+    global store
+    with store_lock:
+        if store != None:
+            store.close()
+            store = None
+
+
+class Codec():
+    """
+    zstd value codec of a namespace, with a trained dictionary when available.
+    Values written with an older dictionary stay readable, unreadable values are misses.
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        # Current dictionary id, 0 = no dictionary
+        self.version = 0
+        self.dictionaries = {}
+        self.local = threading.local()
+        self.reload()
+
+    def reload(self):
+        self.version = get_store().get(self.namespace, 0)
+
+    def dictionary(self, version: int):
+        # Missing dictionaries are not remembered, they may be published later
+        if version not in self.dictionaries:
+            data = get_store().get((self.namespace, version))
+            if data == None:
+                return None
+            self.dictionaries[version] = zstandard.ZstdCompressionDict(data)
+        return self.dictionaries[version]
+
+    def compressor(self, version: int):
+        # zstd contexts are not thread safe: one per thread and version
+        compressors = self.local.__dict__.setdefault('compressors', {})
+        if version not in compressors:
+            dictionary = self.dictionary(version) if version else None
+            compressors[version] = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary)
+        return compressors[version]
+
+    def decompressor(self, version: int):
+        decompressors = self.local.__dict__.setdefault('decompressors', {})
+        if version not in decompressors:
+            dictionary = self.dictionary(version) if version else None
+            if version and dictionary == None:
+                # Dictionary not found: value unreadable
+                return None
+            decompressors[version] = zstandard.ZstdDecompressor(dict_data=dictionary)
+        return decompressors[version]
+
+    def encode(self, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) < CODEC_MIN_SIZE:
+            return value
+        version = self.version
+        return MAGIC + version.to_bytes(8, 'big') + self.compressor(version).compress(data)
+
+    def decode(self, value, default=None):
+        if not isinstance(value, bytes) or value[:len(LEGACY_MAGIC)] != LEGACY_MAGIC:
+            return value
+        if value[:len(MAGIC)] != MAGIC:
+            return default
+        version = int.from_bytes(value[len(MAGIC):len(MAGIC) + 8], 'big')
+        decompressor = self.decompressor(version)
+        if decompressor == None:
+            return default
+        try:
+            return pickle.loads(decompressor.decompress(value[len(MAGIC) + 8:]))
+        except (zstandard.ZstdError, pickle.UnpicklingError, EOFError, ValueError) as e:
+            print(f"Unreadable {self.namespace} value: {e}")
+            return default
+
+    def train(self, samples: list) -> int:
+        """
+        Train and publish a new dictionary from sample values, returns its id.
+        """
+        data = [pickle.dumps(sample, protocol=pickle.HIGHEST_PROTOCOL) for sample in samples]
+        dictionary = zstandard.train_dictionary(DICT_SIZE, data, level=ZSTD_LEVEL).as_bytes()
+        # Same id on every replica (48 bits, exact in JSON), concurrent trainings do not overwrite each other
+        version = int.from_bytes(hashlib.blake2b(dictionary, digest_size=6).digest(), 'big') or 1
+        store = get_store()
+        # Dictionary first: the current id always points to a stored one
+        store.set((self.namespace, version), dictionary)
+        store.set(self.namespace, version)
+        store.set(('trained_at', self.namespace), time.time())
+        self.version = version
+        return version
+
+
+codecs = {}
+def get_codec(namespace: str) -> Codec | None:
+    """
+    Codec of a namespace, None when values are stored as they are.
+    """
+    if zstandard == None or namespace not in CODEC_NAMESPACES:
+        return None
+    if namespace not in codecs:
+        codecs[namespace] = Codec(namespace)
+    return codecs[namespace]
+
+
+def reload():
+    # Another worker published new dictionaries
+    for codec in codecs.values():
+        codec.reload()
+
+
+def train(namespace: str, samples: list) -> int | None:
+    codec = get_codec(namespace)
+    if codec == None or len(samples) < TRAIN_MIN_SAMPLES:
+        return None
+    return codec.train(samples)
+
+
+def status() -> dict:
+    store = get_store()
+    return {
+        namespace: {
+            "version": codec.version,
+            "trained_at": store.get(('trained_at', namespace))
+        }
+        for namespace, codec in codecs.items()
+    }
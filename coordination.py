@@ -0,0 +1,270 @@
+from diskcache import Cache as diskCache
+from contextlib import asynccontextmanager
+from cache import run_in_pool, executor
+import asyncio
+import random
+import time
+import os
+
+# Worker processes sharing ./cache (gunicorn WEB_CONCURRENCY)
+WORKERS = int(os.getenv('WEB_CONCURRENCY', 1))
+# Waits poll the shared store with exponential backoff, from POLL_INTERVAL up to POLL_MAX_INTERVAL
+POLL_INTERVAL = 0.02
+POLL_MAX_INTERVAL = 0.5
+BROADCAST_INTERVAL = 2
+LEASE_TIMEOUT = 120
+
+# Shared store used only for coordination (leases, counters, events)
+shared = None
+def open_cache():
+    global shared
+    shared = diskCache('./cache/shared/coordination', sqlite_cache_size=2000, disk_min_file_size=0)
+
+def close_cache():
+    global shared
+    if shared != None:
+        shared.close()
+
+def is_shared() -> bool:
+    return WORKERS > 1 and shared != None
+
+
+async def poll(attempt, deadline: float = None):
+    """
+    Run `attempt` (blocking store call) on the cache thread pool until it returns a result
+    (not None or False), with exponential backoff and jitter. None once `deadline` (monotonic) is passed.
+    """
+    delay = POLL_INTERVAL
+    while True:
+        result = await run_in_pool(attempt)
+        if result:
+            return result
+        if deadline != None and time.monotonic() > deadline:
+            return None
+        await asyncio.sleep(delay * random.uniform(0.5, 1))
+        delay = min(delay * 2, POLL_MAX_INTERVAL)
+
+
+def add_lease(key, token: str, timeout: float) -> bool:
+    return shared.add(key, token, expire=timeout)
+
+
+def renew_lease(key, token: str, timeout: float) -> bool:
+    with shared.transact():
+        if shared.get(key) != token:
+            return False
+        return shared.touch(key, expire=timeout)
+
+
+def release_lease(key, token: str):
+    with shared.transact():
+        if shared.get(key) == token:
+            shared.delete(key)
+
+
+async def keep_lease(key, token: str, timeout: float):
+    # Held longer than the lease timeout (long builds, retries)
+    while True:
+        await asyncio.sleep(timeout / 3)
+        await run_in_pool(renew_lease, key, token, timeout)
+
+
+# Counting semaphore shared by all workers
+class Semaphore():
+    """
+    Single worker: plain asyncio semaphore.
+    Multi worker: `value` lease slots in the shared store, leases expire if a worker dies
+    and are renewed while held. Store operations run on the cache thread pool,
+    one waiter per worker polls for a free slot (with backoff), the others queue behind it.
+    """
+
+    def __init__(self, name: str, value: int):
+        self.name = name
+        self.value = value
+        self.local = asyncio.Semaphore(value)
+        self.polling = asyncio.Lock()
+
+    async def acquire(self):
+        await self.local.acquire()
+        if not is_shared():
+            return None
+        try:
+            async with self.polling:
+                return await poll(self.try_lease)
+        except BaseException:
+            self.local.release()
+            raise
+
+    def try_lease(self):
+        start = random.randrange(self.value)
+        with shared.transact():
+            for i in range(self.value):
+                slot = ('semaphore', self.name, (start + i) % self.value)
+                if shared.add(slot, os.getpid(), expire=LEASE_TIMEOUT):
+                    return slot
+        return None
+
+    def release(self, slot):
+        if slot != None:
+            # Not waited: the slot is free once deleted
+            executor.submit(shared.delete, slot)
+        self.local.release()
+
+    @asynccontextmanager
+    async def hold(self):
+        slot = await self.acquire()
+        # Long calls (retries, backoff) keep their slot
+        renewal = asyncio.create_task(keep_lease(slot, os.getpid(), LEASE_TIMEOUT)) if slot != None else None
+        try:
+            yield
+        finally:
+            if renewal != None:
+                renewal.cancel()
+            self.release(slot)
+
+
+semaphores = {}
+def semaphore(name: str, value: int) -> Semaphore:
+    if name not in semaphores:
+        semaphores[name] = Semaphore(name, value)
+    return semaphores[name]
+
+
+# Periodic jobs: True when this worker runs it (one worker per `timeout`)
+def try_lease(name: str, timeout: float) -> bool:
+    if not is_shared():
+        return True
+    return shared.add(('lease', name), os.getpid(), expire=timeout)
+
+
+# Cross worker lock with lease, renewed while held
+@asynccontextmanager
+async def lock(name: str, timeout: float = LEASE_TIMEOUT):
+    if not is_shared():
+        yield
+        return
+    key = ('lock', name)
+    token = f"{os.getpid()}:{time.time()}"
+    await poll(lambda: add_lease(key, token, timeout))
+    renewal = asyncio.create_task(keep_lease(key, token, timeout))
+    try:
+        yield
+    finally:
+        renewal.cancel()
+        await run_in_pool(release_lease, key, token)
+
+
+# Single-flight: one fetch per key, other callers wait for its result
+inflight = {}
+# Result given to the waiters when the owner was cancelled
+RETRY = object()
+async def single_flight(key: str, fetch, lookup, timeout: float = LEASE_TIMEOUT, persist=None):
+    """
+    `fetch` is a coroutine function doing the work, `lookup` a coroutine function reading the result from cache.
+    In process callers share the same future, other workers wait for the owner and read the cache.
+    `persist` (coroutine function) stores the queued result before the other workers are let read it.
+    A cancelled owner cancels only itself: one of the waiters fetches again.
+    """
+    while key in inflight:
+        result = await asyncio.shield(inflight[key])
+        if result is not RETRY:
+            return result
+
+    future = asyncio.get_running_loop().create_future()
+    inflight[key] = future
+    try:
+        result = await _fetch_once(key, fetch, lookup, timeout, persist)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.set_result(RETRY)
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        # Avoid "exception never retrieved" when nobody waited
+        future.exception()
+        raise
+    finally:
+        del inflight[key]
+
+
+async def _fetch_once(key: str, fetch, lookup, timeout: float, persist=None):
+    if not is_shared():
+        return await fetch()
+
+    flight_key = ('flight', key)
+    token = f"{os.getpid()}:{time.time()}"
+    deadline = time.monotonic() + timeout
+
+    while not await run_in_pool(add_lease, flight_key, token, timeout):
+        # Another worker is fetching, its result is read once the flight ends
+        if await poll(lambda: flight_key not in shared, deadline) == None:
+            return await fetch()
+        result = await lookup()
+        if result != None:
+            return result
+
+    try:
+        result = await fetch()
+        # Write-behind values are stored before the flight ends
+        if persist != None:
+            await persist()
+        return result
+    finally:
+        await asyncio.shield(run_in_pool(release_lease, flight_key, token))
+
+
+# Shared values (e.g. round robin pointers), blocking: use the async versions on the event loop
+def get_state(name: str, default=None):
+    if is_shared():
+        return shared.get(('state', name), default)
+    return local_state.get(name, default)
+
+def set_state(name: str, value):
+    if is_shared():
+        shared.set(('state', name), value)
+    local_state[name] = value
+
+async def aget_state(name: str, default=None):
+    if not is_shared():
+        return local_state.get(name, default)
+    return await run_in_pool(get_state, name, default)
+
+def set_state_later(name: str, value):
+    # Written on the cache thread pool, not waited
+    local_state[name] = value
+    if is_shared():
+        executor.submit(set_state, name, value)
+
+local_state = {}
+
+
+# Broadcast events to all workers
+seen_events = {}
+def publish(event: str):
+    if is_shared():
+        seen_events[event] = shared.incr(('event', event), default=0)
+
+
+async def watch(handlers: dict):
+    """
+    Poll event counters and run the handler of every event published by another worker.
+    """
+    if not is_shared():
+        return
+
+    for event in handlers:
+        seen_events.setdefault(event, await run_in_pool(shared.get, ('event', event), 0))
+
+    while True:
+        await asyncio.sleep(BROADCAST_INTERVAL)
+        for event, handler in handlers.items():
+            generation = await run_in_pool(shared.get, ('event', event), 0)
+            if generation != seen_events.get(event):
+                seen_events[event] = generation
+                try:
+                    result = handler()
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as e:
+                    print(f"Broadcast handler {event} failed: {e}")
@@ -0,0 +1,160 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import threading
+import time
+import re
+import os
+
+# Meta TTL bounds
+MIN_TTL = timedelta(hours=1).total_seconds()
+DEFAULT_TTL = timedelta(hours=12).total_seconds()
+# Airing content: refreshed around the next air date, at most after this time
+AIRING_MAX_TTL = timedelta(days=2).total_seconds()
+# Ended series and movies out for a while
+STABLE_TTL = timedelta(days=7).total_seconds()
+# Content older than ARCHIVE_AGE
+ARCHIVE_TTL = timedelta(days=30).total_seconds()
+ARCHIVE_AGE = timedelta(days=365).total_seconds()
+# Recent movies can still change (ratings, translations, images)
+RECENT_AGE = timedelta(days=90).total_seconds()
+# Refresh this long after an episode (or movie) air date
+AIR_MARGIN = timedelta(hours=3).total_seconds()
+
+# TMDB find data
+FIND_TTL = timedelta(days=7).total_seconds()
+FIND_RECENT_TTL = timedelta(days=1).total_seconds()
+FIND_ARCHIVE_TTL = timedelta(days=30).total_seconds()
+
+# Anime ids, not converted ids are retried sooner (mapping may be added)
+ANIME_ID_TTL = timedelta(days=30).total_seconds()
+ANIME_ID_MISS_TTL = timedelta(days=3).total_seconds()
+
+# Request frequency (per worker), counts are halved every POPULARITY_WINDOW seconds
+POPULARITY_WINDOW = timedelta(hours=1).total_seconds()
+HOT_REQUESTS = int(os.getenv('HOT_REQUESTS', 20))
+
+ENDED_STATUS = {'ended', 'canceled', 'cancelled', 'finished', 'released'}
+
+requests = Counter()
+requests_lock = threading.Lock()
+decayed_at = time.time()
+
+
+def record_request(key: str):
+    global decayed_at
+    with requests_lock:
+        now = time.time()
+        if now - decayed_at >= POPULARITY_WINDOW:
+            for item in list(requests):
+                requests[item] //= 2
+                if requests[item] == 0:
+                    del requests[item]
+            decayed_at = now
+        requests[key] += 1
+
+
+def is_hot(key: str) -> bool:
+    return requests.get(key, 0) >= HOT_REQUESTS
+
+
+def parse_date(value) -> float | None:
+    """
+    Timestamp of 'YYYY-MM-DD...' dates, None when missing or invalid ('TBA').
+    """
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value[:10], '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+
+def is_ended(meta: dict, status: str = None) -> bool:
+    # TMDB status when present, otherwise a closed year range ('2008-2013')
+    status = str(status or meta.get('status') or '').lower()
+    if status:
+        return status in ENDED_STATUS
+    return re.fullmatch(r'\d{4}\s*[-–]\s*\d{4}', str(meta.get('year') or meta.get('releaseInfo') or '')) != None
+
+
+def tmdb_signals(tmdb_data: dict) -> dict:
+    """
+    TMDB details used by meta_ttl, kept next to the built meta ('freshness' key).
+    """
+    return {
+        "status": tmdb_data.get('status'),
+        "last_air_date": tmdb_data.get('last_air_date'),
+        "next_air_date": (tmdb_data.get('next_episode_to_air') or {}).get('air_date')
+    }
+
+
+def remaining_ttl(meta: dict) -> float | None:
+    """
+    Seconds left before a stored meta expires, None when built now (or stored without expiry).
+    """
+    expires = (meta.get('freshness') or {}).get('expires')
+    if expires == None:
+        return None
+    return max(0, expires - time.time())
+
+
+def meta_ttl(meta: dict, hot: bool = False) -> float:
+    """
+    Seconds a built meta stays cached: long for old movies and ended series,
+    until shortly after the next air date for airing content.
+    Popular entries that can still change are refreshed sooner.
+    """
+    signals = meta.get('freshness') or {}
+    meta = meta.get('meta') or {}
+    if not meta:
+        return MIN_TTL
+    now = time.time()
+
+    # Air dates: next one to come and last one aired
+    dates = [parse_date(video.get('released') or video.get('firstAired')) for video in meta.get('videos') or []]
+    if meta.get('type') == 'movie' or not dates:
+        dates.append(parse_date(meta.get('released')))
+    dates += [parse_date(signals.get('last_air_date')), parse_date(signals.get('next_air_date'))]
+    dates = [date for date in dates if date != None]
+    upcoming = [date for date in dates if date > now]
+    aired = [date for date in dates if date <= now]
+
+    if upcoming:
+        ttl = min(upcoming) + AIR_MARGIN - now
+        ttl = min(max(ttl, MIN_TTL), AIRING_MAX_TTL)
+        return min(ttl, DEFAULT_TTL) if hot else ttl
+
+    last_aired = max(aired) if aired else None
+    if meta.get('type') == 'series' and not is_ended(meta, signals.get('status')):
+        # Running series without a known next episode
+        return DEFAULT_TTL / 2 if hot else DEFAULT_TTL
+    if last_aired == None:
+        return DEFAULT_TTL
+    age = now - last_aired
+    if age >= ARCHIVE_AGE:
+        return ARCHIVE_TTL
+    if age >= RECENT_AGE or meta.get('type') == 'series':
+        return STABLE_TTL
+    return DEFAULT_TTL / 2 if hot else DEFAULT_TTL
+
+
+def find_ttl(item: dict) -> float:
+    """
+    TMDB find data TTL from the release date of the found item.
+    """
+    results = [result for key in ('movie_results', 'tv_results') for result in item.get(key) or []]
+    if not results:
+        return FIND_RECENT_TTL
+    released = parse_date(results[0].get('release_date') or results[0].get('first_air_date'))
+    if released == None:
+        return FIND_TTL
+    age = time.time() - released
+    if age < RECENT_AGE:
+        return FIND_RECENT_TTL
+    if age >= ARCHIVE_AGE:
+        return FIND_ARCHIVE_TTL
+    return FIND_TTL
+
+
+def anime_id_ttl(imdb_id: str | None) -> float:
+    return ANIME_ID_TTL if imdb_id != None and 'tt' in imdb_id else ANIME_ID_MISS_TTL
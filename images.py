@@ -0,0 +1,53 @@
+import re
+
+# TMDB image size per role ('high' keeps the sizes of the stored metas)
+IMAGE_PROFILES = {
+    'low': {'poster': 'w342', 'background': 'w780', 'logo': 'w300', 'thumbnail': 'w300'},
+    'medium': {'poster': 'w500', 'background': 'w1280', 'logo': 'w500', 'thumbnail': 'w300'},
+    'high': None
+}
+DEFAULT_PROFILE = 'high'
+
+TMDB_IMAGE = re.compile(r'^(https://image\.tmdb\.org/t/p/)[^/]+(/.+)$')
+
+
+def resize(url, role: str, profile: str):
+    """
+    TMDB image url with the size of the role in the profile, other urls as they are.
+    """
+    sizes = IMAGE_PROFILES.get(profile)
+    if sizes == None or not isinstance(url, str):
+        return url
+    match = TMDB_IMAGE.match(url)
+    if match == None:
+        return url
+    return f"{match.group(1)}{sizes[role]}{match.group(2)}"
+
+
+def apply_catalog(catalog: dict, profile: str) -> dict:
+    # Catalog items are built for this response, changed in place
+    if IMAGE_PROFILES.get(profile) == None:
+        return catalog
+    for item in catalog.get('metas', []):
+        for role in ('poster', 'background', 'logo'):
+            if role in item:
+                item[role] = resize(item[role], role, profile)
+    return catalog
+
+
+def apply_meta(meta: dict, profile: str) -> dict:
+    """
+    Copy of a (cached, shared) meta with the image sizes of the profile.
+    """
+    if IMAGE_PROFILES.get(profile) == None or not meta.get('meta'):
+        return meta
+    item = dict(meta['meta'])
+    for role in ('poster', 'background', 'logo'):
+        if role in item:
+            item[role] = resize(item[role], role, profile)
+    if item.get('videos'):
+        item['videos'] = [
+            {**video, "thumbnail": resize(video['thumbnail'], 'thumbnail', profile)} if video.get('thumbnail') else video
+            for video in item['videos']
+        ]
+    return {**meta, "meta": item}
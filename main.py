@@ -1,23 +1,33 @@
 from fastapi import FastAPI, Request, Response, Query, UploadFile, File
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
-from datetime import timedelta
-from cache import Cache
 from anime import kitsu, mal
 from anime import anime_mapping
 import meta_merger
 import meta_builder
+import meta_store
 import translator
+import prefetch
+import cache_transfer
+import coordination
+import upstream
+import responses
+import breaker
+import freshness
+import admission
+import images
+import cache
+import codec
+import maintenance
+from settings import parse_user_settings, decode_base64_url, InvalidSettings
 import asyncio
 import httpx
-from api import tmdb, tvdb
-import base64
+from api import tmdb, tvdb, fanart
 import json
+import time
 import os
-import zipfile
-import shutil
 
 # Settings
 translator_version = 'v0.1.9'
@@ -27,6 +37,8 @@ USE_TMDB_ID_META = True
 USE_TMDB_ADDON = False
 TRANSLATE_CATALOG_NAME = False
 REQUEST_TIMEOUT = 120
+# Catalog items not enriched within this time are returned untouched (seconds)
+CATALOG_DEADLINE = float(os.getenv('CATALOG_DEADLINE', 5))
 COMPATIBILITY_ID = ['tt', 'kitsu', 'mal']
 
 # ENV file
@@ -38,56 +50,90 @@ ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD')
 with open("languages/languages.json", "r", encoding="utf-8") as f:
     LANGUAGES = json.load(f) 
 
-# Cache set
-meta_cache = {}
-def open_cache():
-    global meta_cache
-    for language in LANGUAGES:
-        meta_cache[language] = Cache(f"./cache/{language}/meta/tmp",  timedelta(hours=12).total_seconds())
-
-def close_cache():
-    global meta_cache
-    for language in meta_cache:
-        meta_cache[language].close()
-
-def get_cache_lenght():
-    global meta_cache
-    total_len = 0
-    for language in LANGUAGES:
-        total_len += meta_cache[language].get_len()
-    return total_len
-
 # Cache
 def open_all_cache():
+    anime_mapping.open_cache()
     kitsu.open_cache()
     mal.open_cache()
     tmdb.open_cache()
     tvdb.open_cache()
-    open_cache()
+    meta_store.open_cache()
     translator.open_cache()
+    upstream.open_cache()
+    fanart.open_cache()
+    cache.apply_quotas()
 
 def close_all_cache():
+    anime_mapping.close_cache()
     kitsu.close_cache()
     mal.close_cache()
     tmdb.close_cache()
     tvdb.close_cache()
-    close_cache()
+    meta_store.close_cache()
     translator.close_cache()
+    upstream.close_cache()
+    fanart.close_cache()
+
+def reopen_all_cache():
+    close_all_cache()
+    open_all_cache()
+
+# Anime maps, built once and shared by all workers
+async def load_anime_maps(force: bool = False) -> dict:
+    """
+    Download and rebuild the maps in a worker thread, the new index version
+    is swapped in when complete. Returns the build timings (seconds).
+    """
+    report = {}
+    async with coordination.lock('anime_maps'):
+        if force or not anime_mapping.imdb_index.is_fresh():
+            start = time.perf_counter()
+            await anime_mapping.download_maps()
+            report['download'] = round(time.perf_counter() - start, 3)
+            report.update(await asyncio.to_thread(build_anime_maps))
+    anime_mapping.imdb_index.refresh()
+    report['version'] = anime_mapping.imdb_index.version
+    return report
+
+def build_anime_maps() -> dict:
+    timings = {}
+    for name, build in (('kitsu', kitsu.load_anime_map), ('mal', mal.load_anime_map), ('index', anime_mapping.build_index)):
+        start = time.perf_counter()
+        build()
+        timings[name] = round(time.perf_counter() - start, 3)
+    return timings
 
 # Server start
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print('Started')
     # Open Cache
+    coordination.open_cache()
     open_all_cache()
     # Load anime mapping lists
-    await anime_mapping.download_maps()
-    kitsu.load_anime_map()
-    mal.load_anime_map()
+    await load_anime_maps()
+    # Events from other workers
+    watcher_task = asyncio.create_task(coordination.watch({
+        'cache_reopen': lambda: asyncio.to_thread(reopen_all_cache),
+        'codec_reload': codec.reload,
+        'prefetch_stop': prefetch.cancel_local,
+        'map_reload': anime_mapping.imdb_index.refresh
+    }))
+    # Scheduled cache warm-up
+    prefetch_task = asyncio.create_task(prefetch.schedule(app))
+    # Scheduled expiry, culling and vacuum
+    maintenance.start()
     yield
     print('Shutdown')
+    watcher_task.cancel()
+    prefetch_task.cancel()
+    if prefetch.current_job != None:
+        prefetch.current_job.cancel()
+    await asyncio.to_thread(maintenance.stop)
     # Cache close
-    close_all_cache()
+    await asyncio.to_thread(close_all_cache)
+    codec.close_store()
+    coordination.close_cache()
     
 
 app = FastAPI(lifespan=lifespan)
@@ -105,14 +151,48 @@ stremio_headers = {
     'accept-encoding': 'gzip, deflate'
 }
 
-cloudflare_cache_headers = {
-    'Access-Control-Allow-Origin': '*',
-    'Access-Control-Allow-Headers': '*',
-    'Cache-Control': 'no-cache, no-store, must-revalidate',
-    'Pragma': 'no-cache',
-    'Expires': '0',
-    'Surrogate-Control': 'no-store'
-}
+cloudflare_cache_headers = responses.cache_headers('no-store')
+
+
+# Malformed addon url or user settings
+@app.exception_handler(InvalidSettings)
+async def invalid_settings_handler(request: Request, exc: InvalidSettings):
+    return JSONResponse(status_code=400, content={"Error": str(exc)}, headers=cloudflare_cache_headers)
+
+
+# Bounded in-flight addon requests, metas first
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    # Prefetch marker is internal only
+    prefetch_header = prefetch.PREFETCH_HEADER.encode()
+    request.scope['headers'] = [(name, value) for name, value in request.scope['headers'] if name != prefetch_header]
+    route = admission.classify(request)
+    if route == None:
+        return await call_next(request)
+    client = admission.client_key(request)
+    if not await admission.controller.acquire(route, client):
+        return await overloaded_response(request, route)
+    try:
+        return await call_next(request)
+    finally:
+        admission.controller.release(route, client)
+
+
+async def overloaded_response(request: Request, route: str) -> Response:
+    # Catalogs are passed through untranslated, the others are retried later
+    if route == 'catalog':
+        parts = request.url.path.split('/')
+        try:
+            addon_url = decode_base64_url(parts[1])
+            # Short: load shedding must not hold connections
+            async with httpx.AsyncClient(follow_redirects=True, timeout=admission.FALLBACK_TIMEOUT) as client:
+                status, catalog = await upstream.get_json(client, f"{addon_url}/catalog/{'/'.join(parts[4:])}", stremio_headers)
+            if catalog != None:
+                return responses.json_response(request, catalog, 'catalog-partial')
+        except (InvalidSettings, httpx.HTTPError):
+            pass
+    headers = {**cloudflare_cache_headers, 'Retry-After': str(admission.RETRY_AFTER)}
+    return JSONResponse(status_code=503, content={"Error": "Server busy"}, headers=headers)
 
 tmdb_addons_pool = [
     'https://tmdb.elfhosted.com/%7B%22provide_imdbId%22%3A%22true%22%2C%22language%22%3A%22it-IT%22%7D', # Elfhosted
@@ -120,7 +200,21 @@ tmdb_addons_pool = [
     'https://tmdb-catalog.madari.media/%7B%22provide_imdbId%22%3A%22true%22%2C%22language%22%3A%22it-IT%22%7D' # Madari
 ]
 
-tmdb_addon_meta_url = tmdb_addons_pool[0]
+# Preferred TMDB addon (shared between workers) is the last fastest healthy mirror
+async def get_tmdb_addon_meta(client: httpx.AsyncClient, type: str, tmdb_id: str) -> dict:
+    """
+    Hedged request over the mirror pool, starting from the preferred mirror.
+    """
+    start = await coordination.aget_state('tmdb_addon_index', 0) % len(tmdb_addons_pool)
+    mirrors = tmdb_addons_pool[start:] + tmdb_addons_pool[:start]
+    index, response = await breaker.hedged_get(client, mirrors, f"/meta/{type}/{tmdb_id}.json")
+    if response == None or response.status_code != 200:
+        return {}
+    if index != 0:
+        print(f"Switch to {mirrors[index]}")
+        coordination.set_state_later('tmdb_addon_index', (start + index) % len(tmdb_addons_pool))
+    return response.json()
+
 cinemeta_url = 'https://v3-cinemeta.strem.io'
 
 
@@ -142,25 +236,24 @@ async def link_generator(request: Request):
 
 
 @app.get("/manifest.json")
-async def get_manifest():
+async def get_manifest(request: Request):
     with open("manifest.json", "r", encoding="utf-8") as f:
         manifest = json.load(f)
-    return JSONResponse(content=manifest, headers=cloudflare_cache_headers)
+    return responses.json_response(request, manifest, 'static')
 
 
 @app.get('/{addon_url}/{user_settings}/manifest.json')
-async def get_manifest(addon_url, user_settings):
+async def get_manifest(request: Request, addon_url, user_settings):
     addon_url = decode_base64_url(addon_url)
     user_settings = parse_user_settings(user_settings)
-    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
-        response = await client.get(f"{addon_url}/manifest.json", headers=stremio_headers)
-        manifest = response.json()
+    async with httpx.AsyncClient(follow_redirects=True, timeout=REQUEST_TIMEOUT) as client:
+        status, manifest = await upstream.get_json(client, f"{addon_url}/manifest.json", stremio_headers)
 
     is_translated = manifest.get('translated', False)
     if not is_translated:
         manifest['translated'] = True
-        manifest['t_language'] = user_settings.get('language', 'it-IT')
-        manifest['name'] += f" {translator.LANGUAGE_FLAGS[user_settings.get('language', 'it-IT')]}"
+        manifest['t_language'] = user_settings.language
+        manifest['name'] += f" {translator.LANGUAGE_FLAGS[user_settings.language]}"
 
         if 'description' in manifest:
             manifest['description'] += f" | Translated by Toast Translator. {translator_version}"
@@ -186,259 +279,291 @@ async def get_manifest(addon_url, user_settings):
         if 'meta' not in manifest['resources']:
             manifest['resources'].append('meta')
 
-    return JSONResponse(content=manifest, headers=cloudflare_cache_headers)
+    return responses.json_response(request, manifest, 'manifest')
 
 
 @app.get("/{addon_url}/{user_settings}/catalog/{type}/{path:path}")
-async def get_catalog(response: Response, addon_url, type: str, user_settings: str, path: str):
+async def get_catalog(request: Request, addon_url, type: str, user_settings: str, path: str):
     # User settings
     user_settings = parse_user_settings(user_settings)
-    language = user_settings.get('language', 'it-IT')
-    tmdb_key = user_settings.get('tmdb_key', None)
-    rpdb = user_settings.get('rpdb', 'true')
-    rpdb_key = user_settings.get('rpdb_key', 't0-free-rpdb')
-    toast_ratings = user_settings.get('tr', '0')
-    top_stream_poster = user_settings.get('tsp', '0')
-    top_stream_key = user_settings.get('topkey', '')
+    language = user_settings.language
+    tmdb_key = user_settings.tmdb_key
 
     # Convert addon base64 url
     addon_url = decode_base64_url(addon_url)
 
     async with httpx.AsyncClient(follow_redirects=True, timeout=REQUEST_TIMEOUT) as client:
-        response = await client.get(f"{addon_url}/catalog/{type}/{path}", headers=stremio_headers)
+        status, catalog = await upstream.get_json(client, f"{addon_url}/catalog/{type}/{path}", stremio_headers)
 
         # Cinemeta last-videos and calendar
         if 'last-videos' in path or 'calendar-videos' in path:
-            return JSONResponse(content=response.json(), headers=cloudflare_cache_headers)
-        
-        try:
-            catalog = response.json()
-        except:
-            print(f"Error on load catalog: {response.status_code}")
+            return responses.json_response(request, catalog, 'catalog' if status == 200 else 'no-store')
+
+        if catalog == None:
+            print(f"Error on load catalog: {status}")
             return JSONResponse(content={}, headers=cloudflare_cache_headers)
         
         if type == 'anime':
             await remove_duplicates(catalog)
 
         if 'metas' in catalog:
-            tasks = []
-            for item in catalog['metas']:
-                id = item.get('imdb_id', item.get('id'))
-                cached = tmdb.tmp_cache[language].get(id)
-
-                if cached:
-                    tasks.append(asyncio.sleep(0, result=cached))
-                else:
-                    if type == 'anime':
-                        if item.get("animeType") in ("TV", "movie"):
-                            tasks.append(tmdb.get_tmdb_data(client, id, "imdb_id", language, tmdb_key))
-                        else:
-                            tasks.append(asyncio.sleep(0, result={}))
-                    else:
-                        tasks.append(tmdb.get_tmdb_data(client, id, "imdb_id", language, tmdb_key))
-
-            tmdb_details = await asyncio.gather(*tasks)
+            ids = [item.get('imdb_id', item.get('id')) for item in catalog['metas']]
+
+            # All cached items in one round trip
+            cached = await tmdb.tmp_cache[language].aget_many(ids)
+
+            # Misses fetched in one batch
+            misses = []
+            for item, id in zip(catalog['metas'], ids):
+                if id == None or id in cached:
+                    continue
+                if type != 'anime' or item.get("animeType") in ("TV", "movie"):
+                    misses.append(id)
+            misses = list(dict.fromkeys(misses))
+            # Prefetch waits for the whole page
+            deadline = None if prefetch.is_prefetch(request) else CATALOG_DEADLINE
+            fetched = await fetch_catalog_details(misses, language, tmdb_key, deadline)
+            is_partial = len(fetched) < len(misses)
+
+            tmdb_details = [cached.get(id) or fetched.get(id, {}) for id in ids]
         else:
             return JSONResponse(content={}, headers=cloudflare_cache_headers)
 
-    new_catalog = translator.translate_catalog(catalog, tmdb_details, top_stream_poster, toast_ratings, rpdb, rpdb_key, top_stream_key, language)
-    return JSONResponse(content=new_catalog, headers=cloudflare_cache_headers)
+    new_catalog = translator.translate_catalog(catalog, tmdb_details, user_settings)
+    images.apply_catalog(new_catalog, user_settings.image_profile)
+    is_error = any(item.get('id') == 'error:tmdb-key' for item in new_catalog['metas'])
+    if is_error:
+        policy = 'no-store'
+    elif is_partial:
+        policy = 'catalog-partial'
+    else:
+        policy = 'catalog'
+    return responses.json_response(request, new_catalog, policy)
+
+
+# Running catalog enrichments, kept referenced until done
+catalog_tasks = set()
+
+async def fetch_catalog_details(ids: list, language: str, tmdb_key: str, deadline: float = None) -> dict:
+    """
+    Fetch TMDB details of the catalog misses and return the ones ready by the deadline.
+    The others are completed in background (with their own client) and cached for the next request.
+    """
+    fetched = {}
+    if not ids:
+        return fetched
+
+    async def fetch_all():
+        try:
+            async with httpx.AsyncClient(follow_redirects=True, timeout=REQUEST_TIMEOUT) as client:
+                # At most half of the key TMDB slots, the others are left to metas
+                slots = admission.enrichment_slots(tmdb_key)
+                async def fetch(id):
+                    async with slots:
+                        fetched.update(await tmdb.fetch_tmdb_data_many(client, [id], "imdb_id", language, tmdb_key))
+                await asyncio.gather(*[fetch(id) for id in ids])
+        except Exception as e:
+            print(f"Catalog enrichment failed: {e}")
+
+    task = asyncio.create_task(fetch_all())
+    catalog_tasks.add(task)
+    task.add_done_callback(catalog_tasks.discard)
+    await asyncio.wait({task}, timeout=deadline)
+    return dict(fetched)
 
 
 @app.get('/{addon_url}/{user_settings}/meta/{type}/{id}.json')
 async def get_meta(request: Request,response: Response, addon_url, user_settings: str, type: str, id: str):
-    global tmdb_addon_meta_url
-
     headers = dict(request.headers)
     del headers['host']
 
     addon_url = decode_base64_url(addon_url)
     user_settings = parse_user_settings(user_settings)
-    language = user_settings.get('language', 'it-IT')
-    tmdb_key = user_settings.get('tmdb_key', None)
+    language = user_settings.language
+    tmdb_key = user_settings.tmdb_key
+
+    # Request frequency, used for the cache TTL
+    freshness.record_request(id)
+
+    # Get from cache
+    meta = await meta_store.aget_meta(id, language)
+
+    # Not in cache, build it once for all concurrent requests
+    if meta == None:
+        meta = await coordination.single_flight(
+            f"meta:{language}:{id}",
+            lambda: build_meta(addon_url, type, id, language, tmdb_key),
+            lambda: meta_store.aget_meta(id, language),
+            persist=lambda: meta_store.wait_stored(id, language)
+        )
+
+    # Stored metas keep the full sizes, the profile is applied to the response only
+    content = {key: value for key, value in images.apply_meta(meta, user_settings.image_profile).items() if key != 'freshness'}
+    # Client and CDN caching follow the entry lifetime: what is left of it once stored
+    ttl = freshness.remaining_ttl(meta)
+    if ttl == None:
+        ttl = freshness.meta_ttl(meta, freshness.is_hot(id))
+    return responses.json_response(request, content, meta_policy(meta), ttl)
+
+
+def meta_policy(meta: dict) -> str:
+    # Errors and empty metas are not cached by clients
+    meta_id = meta.get('meta', {}).get('id') or 'error'
+    return 'no-store' if 'error' in meta_id else 'meta'
+
 
+async def build_meta(addon_url: str, type: str, id: str, language: str, tmdb_key: str) -> dict:
     async with httpx.AsyncClient(follow_redirects=True, timeout=REQUEST_TIMEOUT) as client:
+        # Handle imdb ids
+        if 'tt' in id:
+            if USE_TMDB_ADDON:
+                tmdb_id = await tmdb.convert_imdb_to_tmdb(id, language, tmdb_key)
+                tasks = [
+                    get_tmdb_addon_meta(client, type, tmdb_id),
+                    upstream.get_source_meta(client, 'cinemeta', f"{cinemeta_url}/meta/{type}/{id}.json")
+                ]
+                tmdb_meta, (status, cinemeta_meta) = await asyncio.gather(*tasks)
+                cinemeta_meta = cinemeta_meta or {}
+            else:
+                # Not use TMDB Addon
+                tmdb_meta, cinemeta_meta = await  meta_builder.build_metadata(id, type, language, tmdb_key)
 
-        # Get from cache
-        meta = meta_cache[language].get(id)
+            # Not empty tmdb meta
+            if len(tmdb_meta.get('meta', [])) > 0:
+                # Invalid TMDB key error
+                if 'error' in tmdb_meta['meta']['id']:
+                    return tmdb_meta
 
-        # Return cached meta
-        if meta != None:
-            return JSONResponse(content=meta, headers=cloudflare_cache_headers)
+                # Not merge anime
+                if id not in kitsu.imdb_ids_map:
+                    tasks = []
+                    meta, merged_videos = meta_merger.merge(tmdb_meta, cinemeta_meta)
+                    if 'freshness' in tmdb_meta:
+                        meta['freshness'] = tmdb_meta['freshness']
+                    tmdb_description = tmdb_meta['meta'].get('description', '')
+
+                    if tmdb_description == '':
+                        tasks.append(translator.translate_with_api(client, meta['meta'].get('description', ''), language))
+
+                    if type == 'series' and (len(meta['meta']['videos']) < len(merged_videos)):
+                        tasks.append(translator.translate_episodes(client, merged_videos, language, tmdb_key))
+
+                    translated_tasks = await asyncio.gather(*tasks)
+                    for task in translated_tasks:
+                        if isinstance(task, list):
+                            meta['meta']['videos'] = task
+                        elif isinstance(task, str):
+                            meta['meta']['description'] = task
+                else:
+                    meta = tmdb_meta
 
-        # Not in cache
-        else:
-            # Handle imdb ids
-            if 'tt' in id:
-                if USE_TMDB_ADDON:
-                    tmdb_id = await tmdb.convert_imdb_to_tmdb(id, language, tmdb_key)
-                    tasks = [
-                        client.get(f"{tmdb_addon_meta_url}/meta/{type}/{tmdb_id}.json"),
-                        client.get(f"{cinemeta_url}/meta/{type}/{id}.json")
-                    ]
-                    metas = await asyncio.gather(*tasks)
-                
-                    # TMDB addon retry and switch addon
-                    for retry in range(6):
-                        if metas[0].status_code == 200:
-                            tmdb_meta = metas[0].json()
-                            break
-                        else:
-                            index = tmdb_addons_pool.index(tmdb_addon_meta_url)
-                            tmdb_addon_meta_url = tmdb_addons_pool[(index + 1) % len(tmdb_addons_pool)]
-                            metas[0] = await client.get(f"{tmdb_addon_meta_url}/meta/{type}/{tmdb_id}.json")
-                            if metas[0].status_code == 200:
-                                tmdb_meta = metas[0].json()
-                                break
-                    tmdb_meta = metas[0]
-
-                    if metas[1].status_code == 200:
-                        cinemeta_meta = metas[1].json()
-                    else:
-                        cinemeta_meta = {}
+            # Empty tmdb_data
+            else:
+                if len(cinemeta_meta.get('meta', [])) > 0:
+                    meta = cinemeta_meta
+                    description = meta['meta'].get('description', '')
+
+                    if type == 'series':
+                        tasks = [
+                            translator.translate_with_api(client, description, language),
+                            translator.translate_episodes(client, meta['meta']['videos'], language, tmdb_key)
+                        ]
+                        description, episodes = await asyncio.gather(*tasks)
+                        meta['meta']['videos'] = episodes
+
+                    elif type == 'movie':
+                        description = await translator.translate_with_api(client, description, language)
+
+                    meta['meta']['description'] = description
+
+                # Empty cinemeta and tmdb return empty meta
                 else:
-                    # Not use TMDB Addon
-                    tmdb_meta, cinemeta_meta = await  meta_builder.build_metadata(id, type, language, tmdb_key)
-                
-                # Not empty tmdb meta
-                if len(tmdb_meta.get('meta', [])) > 0:
-                    # Invalid TMDB key error
-                    if 'error' in tmdb_meta['meta']['id']:
-                        return JSONResponse(content=tmdb_meta, headers=cloudflare_cache_headers)
-                    
-                    # Not merge anime
-                    if id not in kitsu.imdb_ids_map:
-                        tasks = []
-                        meta, merged_videos = meta_merger.merge(tmdb_meta, cinemeta_meta)
-                        tmdb_description = tmdb_meta['meta'].get('description', '')
-                        
-                        if tmdb_description == '':
-                            tasks.append(translator.translate_with_api(client, meta['meta'].get('description', ''), language))
-
-                        if type == 'series' and (len(meta['meta']['videos']) < len(merged_videos)):
-                            tasks.append(translator.translate_episodes(client, merged_videos, language, tmdb_key))
-
-                        translated_tasks = await asyncio.gather(*tasks)
-                        for task in translated_tasks:
-                            if isinstance(task, list):
-                                meta['meta']['videos'] = task
-                            elif isinstance(task, str):
-                                meta['meta']['description'] = task
-                    else:
-                        meta = tmdb_meta
-
-                # Empty tmdb_data
+                    return {}
+
+
+        # Handle kitsu and mal ids
+        elif 'kitsu' in id or 'mal' in id:
+            # Get meta from kitsu addon (shared source cache, also used by the id conversion)
+            id = id.replace('_',':')
+            kitsu_meta_url = f"{kitsu.kitsu_addon_url}/meta/{type}/{id.replace(':','%3A')}.json"
+            status, meta = await upstream.get_source_meta(client, kitsu.kitsu_addon_url, kitsu_meta_url)
+            if meta == None:
+                return {}
+
+            # Extract imdb id, anime type and check convertion to imdb id
+            if 'kitsu' in meta['meta']['id']:
+                imdb_id, is_converted = await kitsu.convert_to_imdb(meta['meta']['id'], meta['meta']['type'])
+            elif 'mal_' in meta['meta']['id']:
+                imdb_id, is_converted = await mal.convert_to_imdb(meta['meta']['id'].replace('_',':'), meta['meta']['type'])
+            meta['meta']['imdb_id'] = imdb_id
+            anime_type = meta['meta'].get('animeType', None)
+            is_converted = imdb_id != None and 'tt' in imdb_id and (anime_type == 'TV' or anime_type == 'movie')
+
+            # Handle converted ids (TV and movies)
+            if is_converted:
+                if USE_TMDB_ADDON:
+                    tmdb_id = await tmdb.convert_imdb_to_tmdb(imdb_id, language, tmdb_key)
+                    # Fastest healthy TMDB addon
+                    meta = await get_tmdb_addon_meta(client, type, tmdb_id) or {'meta': {}}
                 else:
-                    if len(cinemeta_meta.get('meta', [])) > 0:
-                        meta = cinemeta_meta
-                        description = meta['meta'].get('description', '')
-                        
-                        if type == 'series':
-                            tasks = [
-                                translator.translate_with_api(client, description, language),
-                                translator.translate_episodes(client, meta['meta']['videos'], language, tmdb_key)
-                            ]
-                            description, episodes = await asyncio.gather(*tasks)
-                            meta['meta']['videos'] = episodes
-
-                        elif type == 'movie':
-                            description = await translator.translate_with_api(client, description, language)
-
-                        meta['meta']['description'] = description
-                    
-                    # Empty cinemeta and tmdb return empty meta
-                    else:
-                        return JSONResponse(content={}, headers=cloudflare_cache_headers)
-                    
-                
-            # Handle kitsu and mal ids
-            elif 'kitsu' in id or 'mal' in id:
-                # Get meta from kitsu addon
-                id = id.replace('_',':')
-                response = await client.get(f"{kitsu.kitsu_addon_url}/meta/{type}/{id.replace(':','%3A')}.json")
-                meta = response.json()
-
-                # Extract imdb id, anime type and check convertion to imdb id
-                if 'kitsu' in meta['meta']['id']:
-                    imdb_id, is_converted = await kitsu.convert_to_imdb(meta['meta']['id'], meta['meta']['type'])
-                elif 'mal_' in meta['meta']['id']:
-                    imdb_id, is_converted = await mal.convert_to_imdb(meta['meta']['id'].replace('_',':'), meta['meta']['type'])
-                meta['meta']['imdb_id'] = imdb_id
-                anime_type = meta['meta'].get('animeType', None)
-                is_converted = imdb_id != None and 'tt' in imdb_id and (anime_type == 'TV' or anime_type == 'movie')
-
-                # Handle converted ids (TV and movies)
-                if is_converted:
-                    if USE_TMDB_ADDON:
-                        tmdb_id = await tmdb.convert_imdb_to_tmdb(imdb_id, language, tmdb_key)
-                        # TMDB Addons retry
-                        for retry in range(6):
-                            response = await client.get(f"{tmdb_addon_meta_url}/meta/{type}/{tmdb_id}.json")
-                            if response.status_code == 200:
-                                meta = response.json()
-                                break
-                            else:
-                                # Loop addon pool
-                                index = tmdb_addons_pool.index(tmdb_addon_meta_url)
-                                tmdb_addon_meta_url = tmdb_addons_pool[(index + 1) % len(tmdb_addons_pool)]
-                                print(f"Switch to {tmdb_addon_meta_url}")
-                    else:
-                        meta, cinemeta_meta = await meta_builder.build_metadata(imdb_id, type, language, tmdb_key)
-
-                    if len(meta['meta']) > 0:
-                        if type == 'movie':
-                            meta['meta']['behaviorHints']['defaultVideoId'] = id
-                        elif type == 'series':
-                            videos = kitsu.parse_meta_videos(meta['meta']['videos'], imdb_id)
-                            meta['meta']['videos'] = videos
-                    else:
-                        # Get meta from kitsu addon
-                        response = await client.get(f"{kitsu.kitsu_addon_url}/meta/{type}/{id.replace(':','%3A')}.json")
-                        meta = response.json()
-
-                # Handle not corverted and ONA OVA Specials
+                    meta, cinemeta_meta = await meta_builder.build_metadata(imdb_id, type, language, tmdb_key)
+
+                if len(meta['meta']) > 0:
+                    if type == 'movie':
+                        meta['meta']['behaviorHints']['defaultVideoId'] = id
+                    elif type == 'series':
+                        videos = kitsu.parse_meta_videos(meta['meta']['videos'], imdb_id)
+                        meta['meta']['videos'] = videos
                 else:
-                    tasks = []
-                    description = meta['meta'].get('description', '')
-                    videos = meta['meta'].get('videos', [])
+                    # Kitsu addon meta, from the source cache
+                    status, meta = await upstream.get_source_meta(client, kitsu.kitsu_addon_url, kitsu_meta_url)
+                    if meta == None:
+                        return {}
 
-                    if description:
-                        tasks.append(translator.translate_with_api(client, description, language))
+            # Handle not corverted and ONA OVA Specials
+            else:
+                tasks = []
+                description = meta['meta'].get('description', '')
+                videos = meta['meta'].get('videos', [])
 
-                    if type == 'series' and videos:
-                        tasks.append(translator.translate_episodes_with_api(client, videos, language))
+                if description:
+                    tasks.append(translator.translate_with_api(client, description, language))
 
-                    translations = await asyncio.gather(*tasks)
+                if type == 'series' and videos:
+                    tasks.append(translator.translate_episodes_with_api(client, videos, language))
 
-                    idx = 0
-                    if description:
-                        meta['meta']['description'] = translations[idx]
-                        idx += 1
+                translations = await asyncio.gather(*tasks)
 
-                    if type == 'series' and videos:
-                        meta['meta']['videos'] = translations[idx]
+                idx = 0
+                if description:
+                    meta['meta']['description'] = translations[idx]
+                    idx += 1
 
-            # Handle TMDB ids
-            elif 'tmdb' in id:
-                meta, placeholder = await meta_builder.build_metadata(id, type, language, tmdb_key)
-            # Not compatible id
-            else:
-                response = await client.get(f"{addon_url}/meta/{type}/{id}.json", headers=stremio_headers)
-                return JSONResponse(content=response.json(), headers=cloudflare_cache_headers)
+                if type == 'series' and videos:
+                    meta['meta']['videos'] = translations[idx]
+
+        # Handle TMDB ids
+        elif 'tmdb' in id:
+            meta, placeholder = await meta_builder.build_metadata(id, type, language, tmdb_key)
+        # Not compatible id
+        else:
+            response = await client.get(f"{addon_url}/meta/{type}/{id}.json", headers=stremio_headers)
+            return response.json()
 
 
-            meta['meta']['id'] = id
-            meta_cache[language].set(id, meta)
-            return JSONResponse(content=meta, headers=cloudflare_cache_headers)
+        meta['meta']['id'] = id
+        # TTL from release and air dates, status and popularity
+        meta_store.set_meta_later(id, language, meta, freshness.meta_ttl(meta, freshness.is_hot(id)))
+        return meta
 
 
 # Addon catalog reponse
 @app.get('/{addon_url}/{user_settings}/addon_catalog/{path:path}')
-async def get_addon_catalog(addon_url, path: str):
+async def get_addon_catalog(request: Request, addon_url, path: str):
     addon_url = decode_base64_url(addon_url)
     async with httpx.AsyncClient(follow_redirects=True, timeout=REQUEST_TIMEOUT) as client:
         response = await client.get(f"{addon_url}/addon_catalog/{path}", stremio_headers)
-        return JSONResponse(content=response.json(), headers=cloudflare_cache_headers)
+        return responses.json_response(request, response.json(), 'catalog' if response.status_code == 200 else 'no-store')
 
 # Subs redirect
 @app.get('/{addon_url}/{user_settings}/subtitles/{path:path}')
@@ -472,10 +597,9 @@ def check_auth(password: str = Query(...)):
 @app.get('/map_reload')
 async def reload_anime_mapping(password: str = Query(...)):
     if password == ADMIN_PASSWORD:
-        await anime_mapping.download_maps()
-        kitsu.load_anime_map()
-        mal.load_anime_map()
-        return JSONResponse(content={"status": "Anime map updated."}, headers=cloudflare_cache_headers)
+        report = await load_anime_maps(force=True)
+        coordination.publish('map_reload')
+        return JSONResponse(content={"status": "Anime map updated.", "build": report}, headers=cloudflare_cache_headers)
     else:
         return JSONResponse(status_code=401, content={"Error": "Access delined"}, headers=cloudflare_cache_headers)
     
@@ -487,25 +611,56 @@ async def reload_anime_mapping(password: str = Query(...)):
         mal_ids = mal.get_cache_lenght()
         tmdb_elements = tmdb.get_cache_lenght()
         translator_elements = translator.get_cache_lenght()
-        meta_elements = get_cache_lenght()
+        meta_elements = meta_store.get_cache_lenght()
+        upstream_elements = upstream.get_cache_lenght()
+        fanart_elements = fanart.get_cache_lenght()
         response = {
             "kitsu": kitsu_ids,
             "mal": mal_ids,
             "tmdb": tmdb_elements,
             "translator": translator_elements,
             "meta": meta_elements,
-            "total": kitsu_ids + mal_ids + tmdb_elements + translator_elements + meta_elements
+            "upstream": upstream_elements,
+            "fanart": fanart_elements,
+            "total": kitsu_ids + mal_ids + tmdb_elements + translator_elements + meta_elements + upstream_elements + fanart_elements
         }
         return JSONResponse(content=response, headers=cloudflare_cache_headers)
     else:
         return JSONResponse(status_code=401, content={"Error": "Access delined"}, headers=cloudflare_cache_headers)
+
+# Disk usage and quota per namespace
+@app.get('/cache_usage')
+async def cache_usage(password: str = Query(...)):
+    if password == ADMIN_PASSWORD:
+        report = await asyncio.to_thread(cache.usage_report)
+        return JSONResponse(content={"budget": cache.CACHE_SIZE_BUDGET, "namespaces": report}, headers=cloudflare_cache_headers)
+    else:
+        return JSONResponse(status_code=401, content={"Error": "Access delined"}, headers=cloudflare_cache_headers)
     
+# Translation memory reuse
+@app.get('/translation_stats')
+async def translation_stats(password: str = Query(...)):
+    if password == ADMIN_PASSWORD:
+        return JSONResponse(content=translator.get_stats(), headers=cloudflare_cache_headers)
+    else:
+        return JSONResponse(status_code=401, content={"Error": "Access delined"}, headers=cloudflare_cache_headers)
+
+# Train (again) the compression dictionaries
+@app.get('/train_dictionaries')
+async def train_dictionaries(password: str = Query(...)):
+    if password == ADMIN_PASSWORD:
+        trained = await asyncio.to_thread(cache.train_dictionaries, True)
+        coordination.publish('codec_reload')
+        return JSONResponse(content={"trained": trained, "codecs": codec.status()}, headers=cloudflare_cache_headers)
+    else:
+        return JSONResponse(status_code=401, content={"Error": "Access delined"}, headers=cloudflare_cache_headers)
+
 # Cache reopen
 @app.get('/cache_reopen')
 async def reload_anime_mapping(password: str = Query(...)):
     if password == ADMIN_PASSWORD:
-        close_all_cache()
-        open_all_cache()
+        await asyncio.to_thread(reopen_all_cache)
+        coordination.publish('cache_reopen')
         return JSONResponse(content={"status": "Cache Reopen."}, headers=cloudflare_cache_headers)
     else:
         return JSONResponse(status_code=401, content={"Error": "Access delined"}, headers=cloudflare_cache_headers)
@@ -514,95 +669,96 @@ async def reload_anime_mapping(password: str = Query(...)):
 @app.get('/clean_cache')
 async def clean_cache(password: str = Query(...)):
     if password == ADMIN_PASSWORD:
+        # Caches are shared by all workers, one run is enough
+        maintenance.run_now()
+        return JSONResponse(content={"status": "Cache maintenance started.", "maintenance": maintenance.status()}, headers=cloudflare_cache_headers)
+    else:
+        return JSONResponse(status_code=401, content={"Error": "Access delined"}, headers=cloudflare_cache_headers)
+    
+# Cache warm-up start
+@app.get('/prefetch')
+async def start_prefetch(password: str = Query(...), catalog_url: list[str] = Query(...), language: list[str] = Query(...),
+                         tmdb_key: str = Query(prefetch.PREFETCH_TMDB_KEY), max_pages: int = Query(prefetch.PREFETCH_MAX_PAGES)):
+    if password == ADMIN_PASSWORD:
+        job = await prefetch.start_job(app, catalog_url, language, tmdb_key, max_pages)
+        # Already running on another worker
+        if job == None:
+            return JSONResponse(content=prefetch.get_status(), headers=cloudflare_cache_headers)
+        return JSONResponse(content=job.status(), headers=cloudflare_cache_headers)
+    else:
+        return JSONResponse(status_code=401, content={"Error": "Access delined"}, headers=cloudflare_cache_headers)
 
-        # TMDB data
-        for cache in tmdb.tmp_cache.values():
-            cache.expire()
+# Cache warm-up progress
+@app.get('/prefetch_status')
+async def prefetch_status(password: str = Query(...)):
+    if password == ADMIN_PASSWORD:
+        status = await cache.run_in_pool(prefetch.get_status)
+        return JSONResponse(content=status, headers=cloudflare_cache_headers)
+    else:
+        return JSONResponse(status_code=401, content={"Error": "Access delined"}, headers=cloudflare_cache_headers)
 
-        # Meta
-        for cache in meta_cache.values():
-            cache.expire()
+# In-flight and queued requests
+@app.get('/admission_status')
+async def admission_status(password: str = Query(...)):
+    if password == ADMIN_PASSWORD:
+        return JSONResponse(content=admission.controller.status(), headers=cloudflare_cache_headers)
+    else:
+        return JSONResponse(status_code=401, content={"Error": "Access delined"}, headers=cloudflare_cache_headers)
 
-        return JSONResponse(content={"status": "Cache cleaned."}, headers=cloudflare_cache_headers)
+# Cache warm-up stop
+@app.get('/prefetch_stop')
+async def stop_prefetch(password: str = Query(...)):
+    if password == ADMIN_PASSWORD:
+        await prefetch.stop()
+        return JSONResponse(content={"status": "Prefetch stopped."}, headers=cloudflare_cache_headers)
     else:
         return JSONResponse(status_code=401, content={"Error": "Access delined"}, headers=cloudflare_cache_headers)
-    
-# Cache download
+
+# Cache download (streamed gzip NDJSON, filterable)
 @app.get("/download_cache")
-def download_cache(password: str = Query(...)):
-    CACHE_DIR = './cache'
-    ZIP_PATH = './cache.zip'
+def download_cache(password: str = Query(...), namespace: str = Query(None), language: str = Query(None), since: float = Query(0)):
     if password == ADMIN_PASSWORD:
-        print("ciao")
-        if not os.path.exists(CACHE_DIR):
-            return Response(status_code=404)
-
-        # Se esiste già, la cancella
-        if os.path.exists(ZIP_PATH):
-            os.remove(ZIP_PATH)
-
-        # Crea zip
-        with zipfile.ZipFile(ZIP_PATH, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for root, _, files in os.walk(CACHE_DIR):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    zipf.write(file_path, os.path.relpath(file_path, CACHE_DIR))
-
-        return FileResponse(ZIP_PATH, filename="cache.zip", media_type="application/zip", headers=cloudflare_cache_headers)
+        headers = {
+            **cloudflare_cache_headers,
+            'Content-Disposition': 'attachment; filename="cache.ndjson.gz"'
+        }
+        return StreamingResponse(cache_transfer.export_records(namespace, language, since), media_type="application/gzip", headers=headers)
     else:
-        Response(status_code=401)
+        return Response(status_code=401)
 
-# Cache upload
+# Cache upload (merged into live caches)
 @app.post("/upload_cache")
-async def upload_cache(password: str = Query(...), file_url: str = Query(...)):
-
-    CACHE_DIR = "./cache"
-    TMP_UPLOAD = "./uploaded_cache.zip"
+async def upload_cache(request: Request, password: str = Query(...), file_url: str = Query(None)):
 
     if password != ADMIN_PASSWORD:
         return Response(status_code=401)
 
-    try:
-        # 1️⃣ Chiudi la cache corrente
-        close_all_cache()
-
-        # 2️⃣ Scarica lo ZIP dal server esterno
-        async with httpx.AsyncClient(timeout=1200) as client:
-            async with client.stream("GET", file_url) as r:
-                r.raise_for_status()
-                with open(TMP_UPLOAD, "wb") as buffer:
-                    async for chunk in r.aiter_bytes():
-                        buffer.write(chunk)
-
-        # 3️⃣ Cancella la cache esistente
-        if os.path.exists(CACHE_DIR):
-            shutil.rmtree(CACHE_DIR)
-        os.makedirs(CACHE_DIR, exist_ok=True)
-
-        # 4️⃣ Estrai il nuovo file ZIP
-        try:
-            with zipfile.ZipFile(TMP_UPLOAD, "r") as zip_ref:
-                zip_ref.extractall(CACHE_DIR)
-        except zipfile.BadZipFile:
-            os.remove(TMP_UPLOAD)
-            return Response(content="Invalid ZIP file", status_code=400)
+    importer = cache_transfer.RecordImporter()
 
-        # 5️⃣ Pulisci file temporaneo
-        os.remove(TMP_UPLOAD)
+    async def merge(chunks):
+        async for chunk in chunks:
+            batches = importer.feed(chunk)
+            if batches:
+                await asyncio.to_thread(importer.write, batches)
+        await asyncio.to_thread(importer.write, importer.finish())
 
-        # 6️⃣ Riapri la cache
-        open_all_cache()
+    try:
+        # Download dump from external server
+        if file_url:
+            async with httpx.AsyncClient(timeout=1200) as client:
+                async with client.stream("GET", file_url) as r:
+                    r.raise_for_status()
+                    await merge(r.aiter_raw())
+        # Dump sent as request body
+        else:
+            await merge(request.stream())
 
-        return {"status": "cache replaced ✅"}
+        return {"status": "cache merged ✅", "imported": importer.imported, "skipped": importer.skipped}
 
     except httpx.HTTPError as e:
-        if os.path.exists(TMP_UPLOAD):
-            os.remove(TMP_UPLOAD)
         return Response(content=f"Error downloading file: {str(e)}", status_code=500)
 
     except Exception as e:
-        if os.path.exists(TMP_UPLOAD):
-            os.remove(TMP_UPLOAD)
         return Response(content=f"Unexpected error: {str(e)}", status_code=500)
 
 ###############  
@@ -611,20 +767,13 @@ async def upload_cache(password: str = Query(...), file_url: str = Query(...)):
 @app.get('/favicon.ico')
 @app.get('/addon-logo.png')
 async def get_poster_placeholder():
-    return FileResponse("static/img/toast-translator-logo.png", media_type="image/png")
+    return FileResponse("static/img/toast-translator-logo.png", media_type="image/png", headers=responses.cache_headers('static'))
 
 # Languages
 @app.get('/languages.json')
-async def get_languages():
+async def get_languages(request: Request):
     with open("languages/languages.json", "r", encoding="utf-8") as f:
-        return JSONResponse(content=json.load(f), headers=cloudflare_cache_headers)
-
-
-def decode_base64_url(encoded_url):
-    padding = '=' * (-len(encoded_url) % 4)
-    encoded_url += padding
-    decoded_bytes = base64.b64decode(encoded_url)
-    return decoded_bytes.decode('utf-8')
+        return responses.json_response(request, json.load(f), 'static')
 
 
 # Anime only
@@ -656,17 +805,6 @@ async def remove_duplicates(catalog) -> None:
     catalog['metas'] = unique_items
 
 
-def parse_user_settings(user_settings: str) -> dict:
-    settings = user_settings.split(',')
-    _user_settings = {}
-
-    for setting in settings:
-        key, value = setting.split('=')
-        _user_settings[key] = value
-    
-    return _user_settings
-
-
 if __name__ == '__main__':
     import uvicorn
     uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get("PORT", 8080)))
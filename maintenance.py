@@ -0,0 +1,139 @@
+import coordination
+import threading
+import cache
+import time
+import os
+
+# Maintenance settings
+MAINTENANCE_INTERVAL = float(os.getenv('MAINTENANCE_INTERVAL', 30)) # Minutes, 0 = disabled
+EXPIRE_BATCH = 100
+VACUUM_PAGES = 500
+# Vacuum only when free pages are more than this fraction of the file
+VACUUM_MIN_FREE = 0.2
+# Work at most SLICE_TIME seconds, then pause SLICE_PAUSE seconds
+SLICE_TIME = 0.05
+SLICE_PAUSE = 0.1
+
+# Background thread
+thread = None
+wake = threading.Event()
+stopping = threading.Event()
+last_run = {}
+run_lock = threading.Lock()
+
+
+def start():
+    global thread
+    if MAINTENANCE_INTERVAL <= 0 or (thread != None and thread.is_alive()):
+        return
+    stopping.clear()
+    thread = threading.Thread(target=loop, name='cache-maintenance', daemon=True)
+    thread.start()
+
+
+def stop(timeout: float = 10):
+    stopping.set()
+    wake.set()
+    if thread != None:
+        thread.join(timeout)
+
+
+def run_now():
+    """
+    Start a run without waiting for the interval (no-op if already running).
+    """
+    if thread == None or not thread.is_alive():
+        threading.Thread(target=run, name='cache-maintenance', daemon=True).start()
+    else:
+        wake.set()
+
+
+def status() -> dict:
+    return {"running": run_lock.locked(), "last_run": last_run}
+
+
+def loop():
+    interval = MAINTENANCE_INTERVAL * 60
+    while not stopping.is_set():
+        triggered = wake.wait(interval)
+        wake.clear()
+        if stopping.is_set():
+            break
+        # Caches are shared by all workers, one of them does the work
+        if triggered or coordination.try_lease('maintenance', interval):
+            run()
+
+
+def run():
+    """
+    Expire, cull and vacuum every open cache in short time slices, then rebalance quotas.
+    """
+    global last_run
+    if not run_lock.acquire(blocking=False):
+        return
+    started = time.time()
+    totals = {"expired": 0, "culled": 0, "vacuumed_pages": 0, "caches": 0}
+    slicer = Slicer()
+    try:
+        for item in cache.iter_caches():
+            if stopping.is_set():
+                break
+            try:
+                stats = maintain(item, slicer)
+            except Exception as e:
+                print(f"Maintenance failed on {item.dir}: {e}")
+                continue
+            for key, value in stats.items():
+                totals[key] += value
+            totals['caches'] += 1
+        cache.apply_quotas()
+        # First dictionaries, once there are enough values
+        trained = cache.train_dictionaries()
+        if trained:
+            totals['trained'] = trained
+            coordination.publish('codec_reload')
+    finally:
+        run_lock.release()
+    last_run = {**totals, "started_at": started, "duration": round(time.time() - started, 3)}
+    print(f"Cache maintenance: {last_run}")
+
+
+def maintain(item: cache.Cache, slicer) -> dict:
+    stats = {"expired": 0, "culled": 0, "vacuumed_pages": 0}
+    backend = item.backend
+    now = time.time()
+
+    # Expired items, one small transaction per slice
+    while not stopping.is_set():
+        count = backend.expire_batch(now, EXPIRE_BATCH)
+        stats['expired'] += count
+        slicer.pace()
+        if count < EXPIRE_BATCH:
+            break
+
+    # Over quota
+    stats['culled'] = backend.cull()
+    slicer.pace()
+
+    # Give free pages back to the file system
+    while not stopping.is_set():
+        pages = backend.vacuum_step(VACUUM_PAGES, VACUUM_MIN_FREE)
+        stats['vacuumed_pages'] += pages
+        slicer.pace()
+        if pages < VACUUM_PAGES:
+            break
+    return stats
+
+
+class Slicer():
+    """
+    Pause the maintenance thread between work slices, so request threads get the store locks.
+    """
+
+    def __init__(self):
+        self.slice_start = time.monotonic()
+
+    def pace(self):
+        if time.monotonic() - self.slice_start >= SLICE_TIME:
+            stopping.wait(SLICE_PAUSE)
+            self.slice_start = time.monotonic()
@@ -6,6 +6,8 @@ import httpx
 import asyncio
 import urllib.parse
 import translator
+import freshness
+import upstream
 import math
 import json
 
@@ -38,110 +40,175 @@ async def build_metadata(imdb_id: str, type: str, language: str, tmdb_key: str):
         }, {}
 
     async with httpx.AsyncClient(follow_redirects=True, timeout=REQUEST_TIMEOUT) as client:
+        stages = Stages()
+        try:
+            return await build_stages(stages, client, imdb_id, tmdb_id, type, language, tmdb_key)
+        finally:
+            # Optional sources not needed in the end, shared ones finish for their waiters
+            await stages.close()
+
+
+async def build_stages(stages, client: httpx.AsyncClient, imdb_id: str, tmdb_id: str, type: str, language: str, tmdb_key: str):
+    """
+    TMDB details first, then optional sources only for the gaps they leave:
+    fanart when TMDB has no logo in the user language, Cinemeta for rating and fallbacks
+    (along with TMDB when the imdb id is known up front).
+    """
+    if type == 'movie':
+        parse_title = 'title'
+        default_video_id = imdb_id
+        has_scheduled_videos = False
+        details = stages.start('tmdb', lambda: tmdb.get_movie_details(client, tmdb_id, language, tmdb_key))
+        get_fanart = lambda: fanart.get_fanart_movie(client, tmdb_id)
 
-        if type == 'movie':
-            parse_title = 'title'
-            default_video_id = imdb_id
-            has_scheduled_videos = False
-            tasks = [
-                tmdb.get_movie_details(client, tmdb_id, language, tmdb_key),
-                fanart.get_fanart_movie(client, tmdb_id)
-            ]
-
-        elif type == 'series':
-            parse_title = 'name'
-            default_video_id = None
-            has_scheduled_videos = True
-            tasks = [
-                tmdb.get_series_details(client, tmdb_id, language, tmdb_key),
-                fanart.get_fanart_series(client, tmdb_id)
-            ]
-        
-        tasks.append(client.get(f"https://v3-cinemeta.strem.io/meta/{type}/{imdb_id}.json"))
-        data = await asyncio.gather(*tasks)
-        tmdb_data, fanart_data = data[0], data[1]
-        if data[2].status_code == 200:
-            cinemeta_data = data[2].json()
-        else:
-            cinemeta_data = {'meta': {}}
-        
-        # Empty tmdb data
-        if len(tmdb_data) == 0:
-            return {"meta": {}}, cinemeta_data
-
-        # Invalid TMDB key error
-        if tmdb_data.get('error'):
-            return { 
-                    "meta": {
-                        "id": "error:tmdb-key",
-                        "name": "Invalid TMDB Key",
-                        "description": "Invalid TMDB Key",
-                        "poster": "https://i.imgur.com/Zi5UZV3.png",
-                        "type": type
-                    }
-            }, {}
-        
-        title = tmdb_data.get(parse_title, '')
-        poster_path = tmdb_data.get('poster_path', '')
-        backdrop_path = tmdb_data.get('backdrop_path', '')
-        slug = f"{type}/{title.lower().replace(' ', '-')}-{tmdb_data.get('imdb_id', '').replace('tt', '')}"
-        logo = extract_logo(fanart_data, tmdb_data, cinemeta_data, language)
-        directors, writers= extract_crew(tmdb_data)
-        cast = extract_cast(tmdb_data)
-        genres = extract_genres(tmdb_data)
-        year = extract_year(tmdb_data, type)
-        trailers = extract_trailers(tmdb_data)
-        rating = cinemeta_data.get('meta', {}).get('imdbRating', '')
-
-        meta = {
-            "meta": {
-                "imdb_id": tmdb_data.get('imdb_id',''),
-                "name": title,
-                "type": type,
-                "cast": cast,
-                "country": (tmdb_data.get('origin_country') or [''])[0],
-                "description": tmdb_data.get('overview', ''),
-                "director": directors,
-                "genre": genres,
-                "imdbRating": rating,
-                "released": tmdb_data.get('release_date', 'TBA')+'T00:00:00.000Z' if type == 'movie' else tmdb_data.get('first_air_date', 'TBA')+'T00:00:00.000Z',
-                "slug": slug,
-                "writer": writers,
-                "year": year,
-                "poster": tmdb.TMDB_POSTER_URL + poster_path if poster_path else None,
-                "background": tmdb.TMDB_BACK_URL + backdrop_path if backdrop_path else None,
-                "logo": logo,
-                "runtime": convert_minutes_hours(tmdb_data.get('runtime','')) if type == 'movie' else convert_minutes_hours(extract_series_episode_runtime(tmdb_data, cinemeta_data)),
-                "id": 'tmdb:' + str(tmdb_data.get('id', '')),
-                "genres": genres,
-                "releaseInfo": year,
-                "trailerStreams": trailers,
-                "links": build_links(imdb_id, title, slug, rating, cast, writers, directors, genres),
-                "behaviorHints": {
-                    "defaultVideoId": default_video_id,
-                    "hasScheduledVideos": has_scheduled_videos
+    elif type == 'series':
+        parse_title = 'name'
+        default_video_id = None
+        has_scheduled_videos = True
+        # Anime episodes come from TVDB, no TMDB seasons needed
+        details = stages.start('tmdb', lambda: tmdb.get_series_details(client, tmdb_id, language, tmdb_key, not uses_tvdb_episodes(imdb_id)))
+        get_fanart = lambda: fanart.get_fanart_series(client, tmdb_id)
+
+    # Imdb id known up front: Cinemeta (rating, merge and fallback) in parallel with TMDB
+    if 'tt' in imdb_id:
+        stages.start('cinemeta', lambda: get_cinemeta(client, type, imdb_id), shared=True)
+
+    tmdb_data = await details
+
+    # Empty tmdb data, Cinemeta fallback
+    if len(tmdb_data) == 0:
+        return {"meta": {}}, await stages.get('cinemeta', lambda: empty_source())
+
+    # Invalid TMDB key error
+    if tmdb_data.get('error'):
+        return { 
+                "meta": {
+                    "id": "error:tmdb-key",
+                    "name": "Invalid TMDB Key",
+                    "description": "Invalid TMDB Key",
+                    "poster": "https://i.imgur.com/Zi5UZV3.png",
+                    "type": type
                 }
+        }, {}
+
+    # Gaps left by TMDB: Cinemeta for the rating once the imdb id is resolved, fanart for the logo
+    tmdb_imdb_id = tmdb_data.get('imdb_id') or (tmdb_data.get('external_ids') or {}).get('imdb_id')
+    if tmdb_imdb_id:
+        stages.start('cinemeta', lambda: get_cinemeta(client, type, tmdb_imdb_id), shared=True)
+    if extract_tmdb_logo(tmdb_data, language) == None:
+        stages.start('fanart', get_fanart, shared=True)
+
+    # Episodes while the optional sources are fetched
+    if type == 'series':
+        stages.start('videos', lambda: series_build_episodes(client, imdb_id, tmdb_id, tmdb_data.get('seasons', []), tmdb_data['external_ids']['tvdb_id'], tmdb_data['number_of_episodes'], language, tmdb_key, extract_airing_seasons(tmdb_data), tmdb_data))
+
+    cinemeta_data = await stages.get('cinemeta', lambda: empty_source())
+    fanart_data = await stages.get('fanart', lambda: empty_source({}))
+
+    title = tmdb_data.get(parse_title, '')
+    poster_path = tmdb_data.get('poster_path', '')
+    backdrop_path = tmdb_data.get('backdrop_path', '')
+    slug = f"{type}/{title.lower().replace(' ', '-')}-{tmdb_data.get('imdb_id', '').replace('tt', '')}"
+    logo = extract_logo(fanart_data, tmdb_data, cinemeta_data, language)
+    directors, writers= extract_crew(tmdb_data)
+    cast = extract_cast(tmdb_data)
+    genres = extract_genres(tmdb_data)
+    year = extract_year(tmdb_data, type)
+    trailers = extract_trailers(tmdb_data)
+    rating = cinemeta_data.get('meta', {}).get('imdbRating', '')
+
+    meta = {
+        "meta": {
+            "imdb_id": tmdb_data.get('imdb_id',''),
+            "name": title,
+            "type": type,
+            "cast": cast,
+            "country": (tmdb_data.get('origin_country') or [''])[0],
+            "description": tmdb_data.get('overview', ''),
+            "director": directors,
+            "genre": genres,
+            "imdbRating": rating,
+            "released": tmdb_data.get('release_date', 'TBA')+'T00:00:00.000Z' if type == 'movie' else tmdb_data.get('first_air_date', 'TBA')+'T00:00:00.000Z',
+            "slug": slug,
+            "writer": writers,
+            "year": year,
+            "poster": tmdb.TMDB_POSTER_URL + poster_path if poster_path else None,
+            "background": tmdb.TMDB_BACK_URL + backdrop_path if backdrop_path else None,
+            "logo": logo,
+            "runtime": convert_minutes_hours(tmdb_data.get('runtime','')) if type == 'movie' else convert_minutes_hours(extract_series_episode_runtime(tmdb_data, cinemeta_data)),
+            "id": 'tmdb:' + str(tmdb_data.get('id', '')),
+            "genres": genres,
+            "releaseInfo": year,
+            "trailerStreams": trailers,
+            "links": build_links(imdb_id, title, slug, rating, cast, writers, directors, genres),
+            "behaviorHints": {
+                "defaultVideoId": default_video_id,
+                "hasScheduledVideos": has_scheduled_videos
             }
-        }
+        },
+        # Status and air dates for the cache TTL, not sent to clients
+        "freshness": freshness.tmdb_signals(tmdb_data)
+    }
 
-        if type == 'series':
-            meta['meta']['videos'] = await series_build_episodes(client, imdb_id, tmdb_id, tmdb_data.get('seasons', []), tmdb_data['external_ids']['tvdb_id'], tmdb_data['number_of_episodes'], language, tmdb_key)
+    if type == 'series':
+        meta['meta']['videos'] = await stages.get('videos', None)
 
-        return meta, cinemeta_data
+    return meta, cinemeta_data
 
 
-async def series_build_episodes(client: httpx.AsyncClient, imdb_id: str, tmdb_id: str, seasons: list, tvdb_series_id: int, tmdb_episodes_count: int, language: str, tmdb_key: str) -> list:
-    tasks = []
-    videos = []
+class Stages():
+    """
+    Sources of a meta build: each one is started once, by the first stage that needs it,
+    and shared by the later ones. Shared sources (single flight with other requests) are not cancelled.
+    """
 
-    # Fetch TMDB request for seasons details
-    for season in seasons:
-        tasks.append(tmdb.get_season_details(client, tmdb_id, season['season_number'], language, tmdb_key))
+    def __init__(self):
+        self.tasks = {}
+        self.shared = set()
+
+    def start(self, name: str, fetch, shared: bool = False) -> asyncio.Task:
+        if name not in self.tasks:
+            self.tasks[name] = asyncio.ensure_future(fetch())
+            if shared:
+                self.shared.add(name)
+        return self.tasks[name]
 
-    tmdb_seasons = await asyncio.gather(*tasks)
+    async def get(self, name: str, fetch):
+        return await self.start(name, fetch)
+
+    async def close(self):
+        # Before the client is closed
+        waiting = []
+        for name, task in self.tasks.items():
+            if task.done():
+                continue
+            if name in self.shared:
+                waiting.append(task)
+            else:
+                task.cancel()
+        if waiting:
+            await asyncio.wait(waiting)
+
+
+async def empty_source(value: dict = None) -> dict:
+    # Source not needed (or not available)
+    return value if value != None else {'meta': {}}
+
+
+async def get_cinemeta(client: httpx.AsyncClient, type: str, imdb_id: str) -> dict:
+    status, meta = await upstream.get_source_meta(client, 'cinemeta', f"https://v3-cinemeta.strem.io/meta/{type}/{imdb_id}.json")
+    return meta if meta != None else {'meta': {}}
+
+
+def uses_tvdb_episodes(imdb_id: str) -> bool:
+    return ('kitsu' in imdb_id or 'mal' in imdb_id or imdb_id in kitsu.imdb_ids_map) and imdb_id not in TMDB_EXCEPTIONS
+
+
+async def series_build_episodes(client: httpx.AsyncClient, imdb_id: str, tmdb_id: str, seasons: list, tvdb_series_id: int, tmdb_episodes_count: int, language: str, tmdb_key: str, airing_seasons: set = None, series_data: dict = None) -> list:
+    videos = []
 
     # Anime tvdb mapping
-    if ('kitsu' in imdb_id or 'mal' in imdb_id or imdb_id in kitsu.imdb_ids_map) and imdb_id not in TMDB_EXCEPTIONS:
+    if uses_tvdb_episodes(imdb_id):
         # Use TVDB data
 
         # Extract pre translated episodes
@@ -184,6 +251,15 @@ async def series_build_episodes(client: httpx.AsyncClient, imdb_id: str, tmdb_id
         return await translator.translate_episodes(client, videos, language, tmdb_key)
 
 
+    # TMDB seasons details: appended to series details, from cache (unchanged) or batched
+    if airing_seasons == None:
+        airing_seasons = set()
+    season_list = []
+    for season in seasons:
+        fingerprint = season_fingerprint(season) if season['season_number'] not in airing_seasons else None
+        season_list.append((season['season_number'], fingerprint))
+    tmdb_seasons = await tmdb.get_seasons_details(client, tmdb_id, season_list, language, tmdb_key, series_data)
+
     # TMDB episodes builder
     for season in tmdb_seasons:
         for episode_number, episode in enumerate(season['episodes'], start=1):
@@ -206,6 +282,22 @@ async def series_build_episodes(client: httpx.AsyncClient, imdb_id: str, tmdb_id
     return videos
 
 
+def extract_airing_seasons(tmdb_data: dict) -> set:
+    # Seasons that can still change: always fetched again
+    if tmdb_data.get('status') not in ('Returning Series', 'In Production', 'Planned'):
+        return set()
+    airing = set()
+    for key in ('last_episode_to_air', 'next_episode_to_air'):
+        episode = tmdb_data.get(key) or {}
+        if 'season_number' in episode:
+            airing.add(episode['season_number'])
+    return airing
+
+
+def season_fingerprint(season: dict) -> list:
+    return [season.get('episode_count'), season.get('air_date'), season.get('name'), season.get('overview')]
+
+
 def convert_minutes_hours(value):
     total_minutes = int(str(value).replace("min", "").strip())
     
@@ -235,13 +327,20 @@ def extract_series_episode_runtime(tmdb_data: dict, cinemeta_data: dict) -> str:
     return str(runtime) + ' min'
 
 
+def extract_tmdb_logo(tmdb_data: dict, language: str) -> str | None:
+    lang_iso_639_1 = language.split('-')[0]
+    for logo in tmdb_data.get('images', {}).get('logos', []):
+        if logo['iso_639_1'] == lang_iso_639_1:
+            return tmdb.TMDB_POSTER_URL + logo['file_path']
+    return None
+
+
 def extract_logo(fanart_data: dict, tmdb_data: dict, cinemeta_data: dict, language: str) -> str:
     lang_iso_639_1 = language.split('-')[0]
     # Try TMDB logo
-    if len(tmdb_data.get('images', {}).get('logos', [])) > 0:
-        for logo in tmdb_data['images']['logos']:
-            if logo['iso_639_1'] == lang_iso_639_1:
-                return tmdb.TMDB_POSTER_URL + logo['file_path']
+    tmdb_logo = extract_tmdb_logo(tmdb_data, language)
+    if tmdb_logo != None:
+        return tmdb_logo
 
     # FanArt
     en_logo = ''
@@ -0,0 +1,272 @@
+from cache import Cache, executor, run_in_pool
+from concurrent import futures
+from datetime import timedelta
+import asyncio
+import hashlib
+import pickle
+import time
+import json
+
+# Default record TTL, records are usually stored with their own (see freshness.meta_ttl)
+META_TTL = timedelta(hours=12).total_seconds()
+# Season chunks outlive the meta record, they are renewed when the record is stored again
+EPISODES_TTL = timedelta(days=2).total_seconds()
+
+# Load languages
+with open("languages/languages.json", "r", encoding="utf-8") as f:
+    LANGUAGES = json.load(f)
+
+# Fields that change with the language, kept in the per-language overlay
+LOCALIZED_FIELDS = {'name', 'description', 'logo', 'poster', 'background', 'slug', 'genre', 'genres', 'links', 'trailerStreams'}
+LOCALIZED_VIDEO_FIELDS = {'name', 'title', 'overview', 'description'}
+
+# Cache set
+meta_cache = {}
+episodes_cache = {}
+# Language neutral records shared by all languages
+core_cache = None
+core_episodes_cache = None
+# Records queued for write-behind, (language, id) -> meta
+pending = {}
+# Running record writes, (language, id) -> future
+writes = {}
+def open_cache():
+    global meta_cache, episodes_cache, core_cache, core_episodes_cache
+    core_cache = Cache('./cache/shared/meta/core', EPISODES_TTL, namespace='meta-core')
+    core_episodes_cache = Cache('./cache/shared/episodes/core', EPISODES_TTL, namespace='episodes-core')
+    for language in LANGUAGES:
+        meta_cache[language] = Cache(f"./cache/{language}/meta/tmp", META_TTL, namespace='meta', language=language)
+        episodes_cache[language] = Cache(f"./cache/{language}/episodes/tmp", EPISODES_TTL, namespace='episodes', language=language)
+
+def close_cache():
+    global meta_cache, episodes_cache
+    # Wait queued writes (blocking: callers on the event loop run this in a thread)
+    futures.wait(list(writes.values()), timeout=5)
+    for language in meta_cache:
+        meta_cache[language].close()
+        episodes_cache[language].close()
+    core_cache.close()
+    core_episodes_cache.close()
+
+def get_cache_lenght():
+    global meta_cache
+    total_len = core_cache.get_len()
+    for language in LANGUAGES:
+        total_len += meta_cache[language].get_len()
+    return total_len
+
+def expire():
+    for language in meta_cache:
+        meta_cache[language].expire()
+        episodes_cache[language].expire()
+    core_cache.expire()
+    core_episodes_cache.expire()
+
+
+def get_meta(id: str, language: str) -> dict | None:
+    """
+    Merge the shared core with the language overlay and assemble the videos
+    from the season chunks. A missing (or replaced) core or chunk is a cache miss.
+    """
+    queued = pending.get((language, id))
+    if queued != None:
+        return queued
+
+    record = meta_cache[language].get(id)
+    # Old entries without core are rebuilt
+    if record == None or 'core' not in record:
+        return None
+
+    core = core_cache.get(id)
+    if core == None or core['digest'] != record['core']:
+        return None
+    meta = {**record['extra'], "meta": apply_overlay(core['meta'], record['overlay'])}
+
+    seasons = record['episodes']
+    # Movies
+    if seasons == None:
+        return meta
+
+    keys = [chunk_key(id, season) for season, digest, core_digest in seasons]
+    chunks = episodes_cache[language].get_many(keys)
+    cores = core_episodes_cache.get_many(keys)
+    if len(chunks) < len(keys) or len(cores) < len(keys):
+        return None
+
+    videos = []
+    for key in keys:
+        chunk, core_chunk = chunks[key], cores[key]
+        if chunk['core'] != core_chunk['digest']:
+            return None
+        for i, overlay in enumerate(chunk['videos']):
+            core_video = core_chunk['videos'][i] if i < len(core_chunk['videos']) else {}
+            videos.append(apply_overlay(core_video, overlay))
+    meta['meta']['videos'] = videos
+    return meta
+
+
+def set_meta(id: str, language: str, meta: dict, ttl: float = None):
+    """
+    Store the meta as an overlay of the shared core record, videos split by season.
+    The core is written by the first language, the others store only what differs.
+    Unchanged seasons are not written again, only their TTL is renewed.
+    """
+    ttl = ttl if ttl != None else META_TTL
+    meta = with_expiry(meta, ttl)
+    # Shared parts live at least as long as the record
+    shared_ttl = max(EPISODES_TTL, ttl)
+    videos = meta['meta'].get('videos')
+    # Videos are stored in the season chunks
+    fields = {key: value for key, value in meta['meta'].items() if key != 'videos' or not videos}
+    core = core_cache.get(id)
+    if core == None:
+        neutral = {key: value for key, value in fields.items() if key not in LOCALIZED_FIELDS}
+        core = {"digest": make_digest(neutral), "meta": neutral}
+        core_cache.set(id, core, shared_ttl)
+    elif core_cache.touch_many([id], shared_ttl):
+        # Expired meanwhile
+        core_cache.set(id, core, shared_ttl)
+
+    record = {
+        "core": core['digest'],
+        "overlay": make_overlay(fields, core['meta']),
+        "extra": {key: value for key, value in meta.items() if key != 'meta'},
+        "episodes": None
+    }
+
+    if videos:
+        record['episodes'] = set_seasons(id, language, videos, shared_ttl)
+    meta_cache[language].set(id, record, ttl)
+
+
+def set_seasons(id: str, language: str, videos: list, ttl: float = EPISODES_TTL) -> list:
+    """
+    Store the season chunks, returns the record references [season, digest, core digest].
+    """
+    # Group videos by season keeping their order
+    seasons = {}
+    for video in videos:
+        seasons.setdefault(video.get('season', 0), []).append(video)
+    keys = {season: chunk_key(id, season) for season in seasons}
+
+    previous = meta_cache[language].get(id) or {}
+    previous_refs = {ref[0]: ref[1:] for ref in previous.get('episodes') or [] if len(ref) == 3}
+
+    # Shared season cores, written when missing
+    cores = core_episodes_cache.get_many(list(keys.values()))
+    new_cores = {}
+    for season, season_videos in seasons.items():
+        if keys[season] not in cores:
+            neutral = [{key: value for key, value in video.items() if key not in LOCALIZED_VIDEO_FIELDS} for video in season_videos]
+            new_cores[keys[season]] = {"digest": make_digest(neutral), "videos": neutral}
+    # Existing cores renewed, the ones expired meanwhile written again
+    new_cores.update({key: cores[key] for key in core_episodes_cache.touch_many(list(cores), ttl)})
+    core_episodes_cache.set_many(new_cores, ttl)
+    cores.update(new_cores)
+
+    chunks = {}
+    unchanged = []
+    refs = []
+    digests = {}
+    for season, season_videos in seasons.items():
+        key = keys[season]
+        digests[key] = make_digest(season_videos)
+        refs.append([season, digests[key], cores[key]['digest']])
+        if previous_refs.get(season) == [digests[key], cores[key]['digest']]:
+            unchanged.append(key)
+        else:
+            chunks[key] = season_chunk(season_videos, cores[key], digests[key])
+
+    # Renew unchanged seasons, write changed (or expired) ones
+    missing = set(episodes_cache[language].touch_many(unchanged, ttl))
+    for season, key in keys.items():
+        if key in missing:
+            chunks[key] = season_chunk(seasons[season], cores[key], digests[key])
+    episodes_cache[language].set_many(chunks, ttl)
+    return refs
+
+
+def season_chunk(videos: list, core: dict, digest: str) -> dict:
+    overlays = []
+    for i, video in enumerate(videos):
+        core_video = core['videos'][i] if i < len(core['videos']) else {}
+        overlays.append(make_overlay(video, core_video))
+    return {"digest": digest, "core": core['digest'], "videos": overlays}
+
+
+def make_overlay(value: dict, core: dict) -> dict:
+    # Fields to set (new or different) and core fields to remove
+    return {
+        "set": {key: item for key, item in value.items() if key not in core or core[key] != item},
+        "del": [key for key in core if key not in value]
+    }
+
+
+def apply_overlay(core: dict, overlay: dict) -> dict:
+    result = {key: value for key, value in core.items() if key not in overlay['del']}
+    result.update(overlay['set'])
+    return result
+
+
+def make_digest(value) -> str:
+    return hashlib.blake2b(pickle.dumps(value), digest_size=16).hexdigest()
+
+
+async def aget_meta(id: str, language: str) -> dict | None:
+    queued = pending.get((language, id))
+    if queued != None:
+        return queued
+    return await run_in_pool(get_meta, id, language)
+
+
+def with_expiry(meta: dict, ttl: float) -> dict:
+    # Expiry kept with the freshness signals: responses are cached for the remaining lifetime only
+    return {**meta, "freshness": {**(meta.get('freshness') or {}), "expires": time.time() + ttl}}
+
+
+def set_meta_later(id: str, language: str, meta: dict, ttl: float = None):
+    """
+    Store the record on the cache thread pool without waiting for it.
+    """
+    ttl = ttl if ttl != None else META_TTL
+    meta = with_expiry(meta, ttl)
+    pending[(language, id)] = meta
+    future = executor.submit(set_meta, id, language, meta, ttl)
+    writes[(language, id)] = future
+    future.add_done_callback(lambda future: store_done(id, language, meta, future))
+
+
+def store_done(id: str, language: str, meta: dict, future):
+    if future.exception() != None:
+        print(f"Meta store failed for {id}: {future.exception()}")
+    # A newer record may have been queued meanwhile
+    if pending.get((language, id)) is meta:
+        del pending[(language, id)]
+    if writes.get((language, id)) is future:
+        del writes[(language, id)]
+
+
+async def wait_stored(id: str, language: str):
+    # Queued record written (readable by the other workers)
+    future = writes.get((language, id))
+    if future != None:
+        await asyncio.wrap_future(future)
+
+
+# Namespaces of the records meta records point to
+DEPENDENCY_NAMESPACES = {'meta-core', 'episodes-core', 'episodes'}
+def record_dependencies(cache: Cache, id: str, record) -> list:
+    """
+    Records a stored meta record needs to be read: [(cache, key)] of its core and season chunks.
+    """
+    if cache.namespace != 'meta' or not isinstance(record, dict) or 'core' not in record:
+        return []
+    dependencies = [(core_cache, id)]
+    for season, digest, core_digest in record.get('episodes') or []:
+        key = chunk_key(id, season)
+        dependencies += [(episodes_cache[cache.language], key), (core_episodes_cache, key)]
+    return dependencies
+
+
+def chunk_key(id: str, season) -> str:
+    return f"{id}:{season}"
@@ -0,0 +1,268 @@
+from datetime import datetime
+from cache import executor, run_in_pool
+import urllib.parse
+import coordination
+import asyncio
+import base64
+import httpx
+import time
+import os
+
+# Prefetch settings
+PREFETCH_CONCURRENCY = int(os.getenv('PREFETCH_CONCURRENCY', 4))
+PREFETCH_RATE = float(os.getenv('PREFETCH_RATE', 5)) # Requests per second
+PREFETCH_MAX_PAGES = int(os.getenv('PREFETCH_MAX_PAGES', 3))
+PREFETCH_INTERVAL = float(os.getenv('PREFETCH_INTERVAL', 0)) # Hours, 0 = disabled
+PREFETCH_CATALOGS = [url for url in os.getenv('PREFETCH_CATALOGS', '').split(',') if url]
+PREFETCH_LANGUAGES = [language for language in os.getenv('PREFETCH_LANGUAGES', '').split(',') if language]
+PREFETCH_TMDB_KEY = os.getenv('PREFETCH_TMDB_KEY', os.getenv('TMDB_API_KEY'))
+REQUEST_TIMEOUT = 120
+# Job state shared with the other workers every STATE_INTERVAL seconds,
+# a running job not updated for STATE_STALE seconds is dead (worker gone)
+STATE_INTERVAL = 1
+STATE_STALE = REQUEST_TIMEOUT + 60
+
+# ASGI scope extension marking warm-up requests, only set by the in-process transport
+PREFETCH_EXTENSION = 'toast.prefetch'
+# Former marker header, stripped from outside requests
+PREFETCH_HEADER = 'x-toast-prefetch'
+
+# Last started job
+current_job = None
+
+
+class PrefetchJob():
+    """
+    Walk upstream addon catalogs through our own routes (in-process) to
+    populate TMDB ids cache, meta cache and translations.
+    """
+
+    def __init__(self, app, catalog_urls: list[str], languages: list[str], tmdb_key: str, max_pages: int = PREFETCH_MAX_PAGES):
+        self.app = app
+        self.catalog_urls = catalog_urls
+        self.languages = languages
+        self.tmdb_key = tmdb_key
+        self.max_pages = max_pages
+        self.state = 'pending'
+        self.started_at = None
+        self.finished_at = None
+        self.current = None
+        self.pages = 0
+        self.items = 0
+        self.metas = 0
+        self.errors = 0
+        self._task = None
+        # Concurrency budget separated from live traffic
+        self._semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        self._next_slot = 0
+        self._saved_at = 0
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def cancel(self):
+        if self._task != None and not self._task.done():
+            self._task.cancel()
+
+    def is_running(self) -> bool:
+        return self._task != None and not self._task.done()
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "current": self.current,
+            "catalogs": len(self.catalog_urls),
+            "languages": self.languages,
+            "pages": self.pages,
+            "items": self.items,
+            "metas": self.metas,
+            "errors": self.errors
+        }
+
+    def save_state(self, force: bool = False):
+        # Visible to /prefetch_status of every worker, written off the event loop
+        now = time.monotonic()
+        if force or now - self._saved_at >= STATE_INTERVAL:
+            self._saved_at = now
+            executor.submit(coordination.set_state, 'prefetch_job', {**self.status(), "worker": os.getpid(), "updated_at": time.time()})
+
+    async def run(self):
+        self.state = 'running'
+        self.started_at = datetime.now().isoformat()
+        self.save_state(force=True)
+        transport = httpx.ASGITransport(app=mark_internal(self.app))
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url='http://prefetch', timeout=REQUEST_TIMEOUT) as client:
+                for language in self.languages:
+                    for catalog_url in self.catalog_urls:
+                        self.current = f"{language} {catalog_url}"
+                        try:
+                            await self.walk_catalog(client, catalog_url, language)
+                        except Exception as e:
+                            print(f"Prefetch error on {catalog_url}: {e}")
+                            self.errors += 1
+            self.state = 'completed'
+        except asyncio.CancelledError:
+            self.state = 'cancelled'
+            raise
+        finally:
+            self.current = None
+            self.finished_at = datetime.now().isoformat()
+            self.save_state(force=True)
+
+    async def walk_catalog(self, client: httpx.AsyncClient, catalog_url: str, language: str):
+        addon_url, type, catalog_id, extra = parse_catalog_url(catalog_url)
+        base_path = f"/{encode_base64_url(addon_url)}/{build_user_settings(language, self.tmdb_key)}"
+        skip = 0
+
+        for page in range(self.max_pages):
+            extra_page = dict(extra)
+            if skip > 0:
+                extra_page['skip'] = str(skip)
+            path = f"{base_path}/catalog/{type}/{catalog_id}"
+            if extra_page:
+                path += '/' + urllib.parse.urlencode(extra_page)
+
+            response = await self.request(client, f"{path}.json")
+            if response == None:
+                break
+
+            metas = response.json().get('metas', [])
+            self.pages += 1
+            if len(metas) == 0:
+                break
+
+            tasks = [self.prefetch_meta(client, base_path, item) for item in metas]
+            await asyncio.gather(*tasks)
+            skip += len(metas)
+
+    async def prefetch_meta(self, client: httpx.AsyncClient, base_path: str, item: dict):
+        self.items += 1
+        id = item.get('id', '')
+        if id.startswith('error:'):
+            return
+        response = await self.request(client, f"{base_path}/meta/{item.get('type')}/{id}.json")
+        if response != None:
+            self.metas += 1
+
+    async def request(self, client: httpx.AsyncClient, path: str) -> httpx.Response | None:
+        async with self._semaphore:
+            await self.wait_rate()
+            try:
+                response = await client.get(path)
+            except Exception as e:
+                print(f"Prefetch request failed {path}: {e}")
+                self.errors += 1
+                return None
+
+        self.save_state()
+        if response.status_code != 200:
+            self.errors += 1
+            return None
+        return response
+
+    async def wait_rate(self):
+        # Simple pacing: one request slot every 1 / PREFETCH_RATE seconds
+        interval = 1 / PREFETCH_RATE if PREFETCH_RATE > 0 else 0
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+async def start_job(app, catalog_urls: list[str], languages: list[str], tmdb_key: str, max_pages: int = PREFETCH_MAX_PAGES) -> PrefetchJob | None:
+    """
+    Start a job, None when a job is already running on another worker.
+    """
+    global current_job
+    if current_job != None and current_job.is_running():
+        return current_job
+    if await run_in_pool(is_running):
+        return None
+
+    current_job = PrefetchJob(app, catalog_urls, languages, tmdb_key, max_pages)
+    current_job.start()
+    return current_job
+
+
+def mark_internal(app):
+    # Outside clients can not reach the scope, unlike headers
+    async def internal_app(scope, receive, send):
+        scope['extensions'] = {**(scope.get('extensions') or {}), PREFETCH_EXTENSION: {}}
+        await app(scope, receive, send)
+    return internal_app
+
+
+def is_prefetch(request) -> bool:
+    return PREFETCH_EXTENSION in (request.scope.get('extensions') or {})
+
+
+def get_status() -> dict:
+    # Last job of any worker
+    return coordination.get_state('prefetch_job') or {"state": "idle"}
+
+
+def is_running() -> bool:
+    state = coordination.get_state('prefetch_job')
+    return state != None and state['state'] == 'running' and time.time() - state['updated_at'] < STATE_STALE
+
+
+async def stop():
+    """
+    Cancel the job of this worker and ask the others to cancel theirs.
+    """
+    cancel_local()
+    await run_in_pool(coordination.publish, 'prefetch_stop')
+
+
+def cancel_local():
+    if current_job != None:
+        current_job.cancel()
+
+
+async def schedule(app):
+    """
+    Periodic prefetch configured from environment, run by one worker per interval.
+    """
+    if PREFETCH_INTERVAL <= 0 or not PREFETCH_CATALOGS or not PREFETCH_LANGUAGES:
+        return
+
+    interval = PREFETCH_INTERVAL * 3600
+    while True:
+        if await run_in_pool(coordination.try_lease, 'prefetch', interval):
+            job = await start_job(app, PREFETCH_CATALOGS, PREFETCH_LANGUAGES, PREFETCH_TMDB_KEY)
+            try:
+                if job != None:
+                    await job._task
+            except Exception as e:
+                print(f"Prefetch job failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def parse_catalog_url(catalog_url: str) -> tuple[str, str, str, dict]:
+    """
+    https://addon/catalog/movie/top/genre=Action.json -> (https://addon, movie, top, {genre: Action})
+    """
+    addon_url, path = catalog_url.split('/catalog/', 1)
+    path = path.removesuffix('.json')
+    parts = path.split('/')
+    type, catalog_id = parts[0], parts[1]
+    extra = {}
+    if len(parts) > 2:
+        extra = dict(urllib.parse.parse_qsl(parts[2]))
+    return addon_url.removesuffix('/manifest.json'), type, catalog_id, extra
+
+
+def encode_base64_url(url: str) -> str:
+    return base64.b64encode(url.encode('utf-8')).decode('utf-8')
+
+
+def build_user_settings(language: str, tmdb_key: str | None) -> str:
+    user_settings = f"rpdb=0,tr=0,tsp=0,language={language}"
+    if tmdb_key:
+        user_settings += f",tmdb_key={tmdb_key}"
+    return user_settings
@@ -0,0 +1,185 @@
+from fastapi import Request, Response
+from cachetools import LRUCache
+import hashlib
+import json
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Compressed variants kept in memory, keyed by ETag and encoding (bytes)
+VARIANTS_CACHE_SIZE = int(os.getenv('VARIANTS_CACHE_SIZE', 64 * 1024 * 1024))
+
+cors_headers = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': '*'
+}
+
+# Per route cache policies (browser max-age / CDN s-maxage)
+CACHE_POLICIES = {
+    'no-store': {
+        'Cache-Control': 'no-cache, no-store, must-revalidate',
+        'Pragma': 'no-cache',
+        'Expires': '0',
+        'Surrogate-Control': 'no-store'
+    },
+    'static': {
+        'Cache-Control': 'public, max-age=86400, s-maxage=604800'
+    },
+    'manifest': {
+        'Cache-Control': 'public, max-age=3600, s-maxage=3600, stale-while-revalidate=3600'
+    },
+    'catalog': {
+        'Cache-Control': 'public, max-age=600, s-maxage=1800, stale-while-revalidate=600'
+    },
+    # Some items still being enriched
+    'catalog-partial': {
+        'Cache-Control': 'public, max-age=30, s-maxage=30'
+    },
+    'meta': {
+        'Cache-Control': 'public, max-age=3600, s-maxage=43200, stale-while-revalidate=3600'
+    }
+}
+# With an entry TTL: CDN keeps the response for the TTL, clients for a share of it
+CLIENT_TTL_SHARE = 1 / 12
+MIN_CLIENT_MAX_AGE = 60
+
+
+# Compressed bodies, content addressed: a changed cache entry gets a new ETag
+variants = LRUCache(maxsize=VARIANTS_CACHE_SIZE, getsizeof=len)
+
+ENCODING_SUFFIX = {
+    'br': '-br',
+    'gzip': '-gz'
+}
+
+
+def cache_headers(policy: str, ttl: float = None) -> dict:
+    headers = {**cors_headers, **CACHE_POLICIES[policy]}
+    if ttl != None and policy != 'no-store':
+        max_age = max(MIN_CLIENT_MAX_AGE, int(ttl * CLIENT_TTL_SHARE))
+        headers['Cache-Control'] = f"public, max-age={max_age}, s-maxage={int(ttl)}, stale-while-revalidate={max_age}"
+    return headers
+
+
+def render(content) -> bytes:
+    # JSONResponse serialization, keys sorted: a record merged back from the
+    # store (other key order) keeps the ETag of the freshly built one
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip().removeprefix('W/')
+        # Same representation with another content-coding
+        for suffix in ENCODING_SUFFIX.values():
+            candidate = candidate.replace(suffix + '"', '"')
+        if candidate == etag:
+            return True
+    return False
+
+
+def select_encoding(accept_encoding: str | None) -> str | None:
+    """
+    Best supported content-coding from Accept-Encoding (br > gzip).
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0
+        accepted[coding.strip()] = q
+
+    for coding in ('br', 'gzip'):
+        if coding == 'br' and brotli == None:
+            continue
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def body_encoding(request: Request, body: bytes) -> str | None:
+    # Content-coding sent for this body (None: identity)
+    if len(body) < COMPRESS_MIN_SIZE:
+        return None
+    return select_encoding(request.headers.get('accept-encoding'))
+
+
+def variant_etag(etag: str, encoding: str | None) -> str:
+    # Each content-coding is its own representation with its own strong ETag
+    if encoding == None:
+        return etag
+    return etag[:-1] + ENCODING_SUFFIX[encoding] + '"'
+
+
+def encode_body(request: Request, body: bytes, headers: dict, etag: str = None) -> bytes:
+    """
+    Compress the body for the client, reusing the stored variant of the same ETag.
+    """
+    headers['Vary'] = 'Accept-Encoding'
+    encoding = body_encoding(request, body)
+    if encoding == None:
+        return body
+
+    if etag != None:
+        key = (etag, encoding)
+        encoded = variants.get(key)
+        if encoded == None:
+            encoded = compress(body, encoding)
+            variants[key] = encoded
+        headers['ETag'] = variant_etag(etag, encoding)
+    else:
+        encoded = compress(body, encoding)
+
+    headers['Content-Encoding'] = encoding
+    return encoded
+
+
+def json_response(request: Request, content, policy: str = 'no-store', ttl: float = None) -> Response:
+    """
+    JSON response with cache policy headers, strong ETag and negotiated compression.
+    `ttl` (seconds) replaces the max-age of the policy. Matching If-None-Match gets an empty 304.
+    """
+    headers = cache_headers(policy, ttl)
+    body = render(content)
+    if policy == 'no-store':
+        body = encode_body(request, body, headers)
+        return Response(content=body, media_type='application/json', headers=headers)
+
+    etag = make_etag(body)
+    headers['ETag'] = etag
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        # Same ETag as the 200 of the negotiated representation
+        headers['Vary'] = 'Accept-Encoding'
+        headers['ETag'] = variant_etag(etag, body_encoding(request, body))
+        return Response(status_code=304, headers=headers)
+
+    body = encode_body(request, body, headers, etag)
+    return Response(content=body, media_type='application/json', headers=headers)
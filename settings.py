@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from images import IMAGE_PROFILES, DEFAULT_PROFILE
+import binascii
+import base64
+import json
+
+# Distinct installed addons kept parsed
+SETTINGS_CACHE_SIZE = 4096
+
+DEFAULT_LANGUAGE = 'it-IT'
+
+# Load languages
+with open("languages/languages.json", "r", encoding="utf-8") as f:
+    LANGUAGES = json.load(f)
+
+
+class InvalidSettings(ValueError):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class UserSettings():
+    """
+    Parsed user settings path segment (shared between requests, read only).
+    """
+    language: str = DEFAULT_LANGUAGE
+    tmdb_key: str | None = None
+    rpdb: bool = False
+    rpdb_key: str = 't0-free-rpdb'
+    toast_ratings: bool = False
+    top_stream_poster: bool = False
+    top_stream_key: str = ''
+    # TMDB image sizes (images.IMAGE_PROFILES)
+    image_profile: str = DEFAULT_PROFILE
+
+    @property
+    def rpdb_free(self) -> bool:
+        # Free RPDB keys do not support the poster language
+        return 't0' in self.rpdb_key
+
+
+@lru_cache(maxsize=SETTINGS_CACHE_SIZE)
+def parse_user_settings(user_settings: str) -> UserSettings:
+    """
+    Parse 'key=value,key=value' settings, raises InvalidSettings when malformed.
+    """
+    values = {}
+    for setting in user_settings.split(','):
+        key, separator, value = setting.partition('=')
+        if not separator or not key or '=' in value:
+            raise InvalidSettings(f"Invalid setting: {setting}")
+        values[key] = value
+
+    language = values.get('language', DEFAULT_LANGUAGE)
+    if language not in LANGUAGES:
+        raise InvalidSettings(f"Unsupported language: {language}")
+
+    image_profile = values.get('img', DEFAULT_PROFILE)
+    if image_profile not in IMAGE_PROFILES:
+        raise InvalidSettings(f"Unsupported image size: {image_profile}")
+
+    return UserSettings(
+        language=language,
+        tmdb_key=values.get('tmdb_key'),
+        rpdb=values.get('rpdb') == '1',
+        rpdb_key=values.get('rpdb_key', 't0-free-rpdb'),
+        toast_ratings=values.get('tr') == '1',
+        top_stream_poster=values.get('tsp') == '1',
+        top_stream_key=values.get('topkey', ''),
+        image_profile=image_profile
+    )
+
+
+@lru_cache(maxsize=SETTINGS_CACHE_SIZE)
+def decode_base64_url(encoded_url: str) -> str:
+    padding = '=' * (-len(encoded_url) % 4)
+    try:
+        return base64.b64decode(encoded_url + padding).decode('utf-8')
+    except (binascii.Error, UnicodeDecodeError):
+        raise InvalidSettings('Invalid addon url')
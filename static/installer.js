@@ -87,6 +87,7 @@ function generateTranslatorLink(addonUrl, rpdb, toast_ratings, tsPoster) {
     const language = document.getElementById("language").value;
     let rpdbKey = document.getElementById("rpdb-key").value;
     const topPosterKey = document.getElementById("top-key").value;
+    const imageSize = document.getElementById("image-size").value;
     if (!rpdbKey) {
         rpdbKey = "t0-free-rpdb";
     }
@@ -97,6 +98,9 @@ function generateTranslatorLink(addonUrl, rpdb, toast_ratings, tsPoster) {
     else if (tsPoster) {
         userSettings += `,topkey=${topPosterKey}`
     }
+    if (imageSize && imageSize !== "high") {
+        userSettings += `,img=${imageSize}`
+    }
     
     if (addonUrl.includes(serverUrl)) {
         const addonBase64String = addonUrl.split("/")[3];
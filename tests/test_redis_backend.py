@@ -0,0 +1,61 @@
+import time
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from cache import RedisBackend
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+def make_backend(server) -> RedisBackend:
+    # One backend per replica, all on the same redis server
+    return RedisBackend('./cache/test', client=fakeredis.FakeRedis(server=server))
+
+
+def test_get_many_round_trip(server):
+    backend = make_backend(server)
+    backend.set_many({'a': {'name': 'A'}, 'b': 'x' * 2000}, expire=60)
+    backend.set('c', [1, 2, 3])
+
+    replica = make_backend(server)
+    assert replica.get_many(['a', 'b', 'c', 'missing']) == {'a': {'name': 'A'}, 'b': 'x' * 2000, 'c': [1, 2, 3]}
+    assert replica.get('missing', 'default') == 'default'
+
+
+def test_key_typing(server):
+    backend = make_backend(server)
+    backend.set(5, 'int')
+    backend.set('5', 'str')
+    backend.set((5,), 'tuple')
+
+    replica = make_backend(server)
+    assert replica.get_many([5, '5', (5,)]) == {5: 'int', '5': 'str', (5,): 'tuple'}
+    assert {key for key, *_ in replica.iter_records()} == {5, '5', (5,)}
+
+
+def test_expiry(server):
+    backend = make_backend(server)
+    # Sub-second expiries are kept (not truncated to 0 seconds)
+    backend.set('short', 'value', expire=0.2)
+    backend.set_many({'many': 'value'}, expire=0.2)
+    backend.set('kept', 'value', expire=60)
+    backend.set('forever', 'value')
+    assert 0 < backend.client.pttl(backend.make_key('short')) <= 200
+    assert backend.client.ttl(backend.make_key('forever')) == -1
+    assert backend.touch_many(['kept', 'missing'], expire=0.2) == ['missing']
+    assert 0 < backend.client.pttl(backend.make_key('kept')) <= 200
+
+    time.sleep(0.3)
+    replica = make_backend(server)
+    assert replica.get_many(['short', 'many', 'kept', 'forever']) == {'forever': 'value'}
+
+
+def test_set_records_expiry(server):
+    backend = make_backend(server)
+    now = time.time()
+    assert backend.set_records([('past', 1, now - 1), ('soon', 2, now + 0.5), ('none', 3, None)]) == 2
+    assert 0 < backend.client.pttl(backend.make_key('soon')) <= 500
+    assert backend.get_many(['past', 'soon', 'none']) == {'soon': 2, 'none': 3}
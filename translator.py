@@ -1,6 +1,12 @@
-from cache import Cache
+from cache import Cache, executor
+from collections import Counter
 import api.tmdb as tmdb
+from settings import UserSettings
+import coordination
+import breaker
 import urllib.parse
+import unicodedata
+import hashlib
 import asyncio
 import httpx
 import json
@@ -14,17 +20,24 @@ with open("languages/lang_flags.json", "r", encoding="utf-8") as f:
 with open("languages/lang_episode.json", "r", encoding="utf-8") as f:
     EPISODE_TRANSLATIONS = json.load(f) 
 
+# Translation memory key version, change it when the provider output changes
+PROVIDER_VERSION = 'lingva-1'
+
 # Cache set
 translations_cache = {}
+# Source texts by hash, stored once for all languages
+sources_cache = None
 def open_cache():
-    global translations_cache
+    global translations_cache, sources_cache
+    sources_cache = Cache('./cache/shared/translation/sources', namespace='translation-source')
     for language in LANGUAGES:
-        translations_cache[language] = Cache(f"./cache/{language}/translation/tmp")
+        translations_cache[language] = Cache(f"./cache/{language}/translation/tmp", namespace='translation', language=language)
 
 def close_cache():
     global translations_cache
     for language in translations_cache:
         translations_cache[language].close()
+    sources_cache.close()
 
 def get_cache_lenght():
     global translations_cache
@@ -38,19 +51,77 @@ RATINGS_SERVER = os.getenv('TR_SERVER', 'https://ca6771aaa821-toast-ratings.baby
 
 
 
-async def translate_with_api(client: httpx.AsyncClient, text: str, language: str, source='en') -> str:
+# Translation memory reuse (this worker)
+stats = {
+    "hits": Counter(),
+    "misses": Counter()
+}
 
-    translation = translations_cache[language].get(text)
-    target = language.split('-')[0]
-    if translation == None and text != None and text != '':
-        api_url = f"https://lingva-translate-azure.vercel.app/api/v1/{source}/{target}/{urllib.parse.quote(text)}"
+def get_stats() -> dict:
+    languages = {}
+    for language in set(stats['hits']) | set(stats['misses']):
+        hits, misses = stats['hits'][language], stats['misses'][language]
+        languages[language] = {"hits": hits, "misses": misses, "reuse_rate": round(hits / (hits + misses), 3)}
+    hits, misses = sum(stats['hits'].values()), sum(stats['misses'].values())
+    return {
+        "hits": hits,
+        "misses": misses,
+        "reuse_rate": round(hits / (hits + misses), 3) if hits + misses > 0 else None,
+        "languages": languages
+    }
+
+
+def normalize_text(text: str) -> str:
+    return ' '.join(unicodedata.normalize('NFC', text).split())
 
-        response = await client.get(api_url)
-        translated_text = response.json().get('translation', '')
-        translations_cache[language].set(text, translated_text)
-    else:
-        translated_text = translation
 
+def memory_key(text: str, source: str) -> tuple[str, str]:
+    """
+    (source hash, translation key): same normalized text, same entry for every show.
+    """
+    digest = hashlib.blake2b(f"{source}\x00{normalize_text(text)}".encode('utf-8'), digest_size=16).hexdigest()
+    return digest, f"{PROVIDER_VERSION}:{source}:{digest}"
+
+
+async def translate_with_api(client: httpx.AsyncClient, text: str, language: str, source='en') -> str:
+    if text == None or normalize_text(text) == '':
+        return text
+
+    digest, key = memory_key(text, source)
+    # Entry, or one stored with the raw text key (before the translation memory), in one read
+    found = await translations_cache[language].aget_many([key, text])
+    if key in found:
+        stats['hits'][language] += 1
+        return found[key]
+
+    # Legacy entry moved to the memory key
+    if text in found:
+        stats['hits'][language] += 1
+        translations_cache[language].set_later(key, found[text])
+        executor.submit(translations_cache[language].delete, text)
+        return found[text]
+
+    stats['misses'][language] += 1
+    return await coordination.single_flight(
+        f"translation:{language}:{key}",
+        lambda: fetch_translation(client, text, language, source, digest, key),
+        lambda: translations_cache[language].aget(key),
+        persist=translations_cache[language].aflush
+    )
+
+
+async def fetch_translation(client: httpx.AsyncClient, text: str, language: str, source: str, digest: str, key: str) -> str:
+    target = language.split('-')[0]
+    # Original text sent (paragraphs kept), the normalized one is only the memory key
+    api_url = f"https://lingva-translate-azure.vercel.app/api/v1/{source}/{target}/{urllib.parse.quote(text.strip())}"
+
+    response = await breaker.get('lingva', client, api_url)
+    # Translator down: keep the original text, not cached
+    if response == None or response.status_code >= 500:
+        return text
+    translated_text = response.json().get('translation', '')
+    translations_cache[language].set_later(key, translated_text)
+    sources_cache.set_later(digest, text)
     return translated_text
 
 
@@ -70,8 +141,11 @@ async def translate_episodes_with_api(client: httpx.AsyncClient, episodes: list[
     return episodes
 
 
-def translate_catalog(original: dict, tmdb_meta: dict, top_stream_poster, toast_ratings, rpdb, rpdb_key, top_stream_key, language: str) -> dict:
+def translate_catalog(original: dict, tmdb_meta: dict, settings: UserSettings) -> dict:
     new_catalog = original
+    language = settings.language
+    rpdb_key = settings.rpdb_key
+    top_stream_key = settings.top_stream_key
 
     for i, item in enumerate(new_catalog['metas']):
         is_error = tmdb_meta[i].get('error', None)
@@ -82,16 +156,16 @@ def translate_catalog(original: dict, tmdb_meta: dict, top_stream_poster, toast_
                 detail = tmdb_meta[i][f"{type_key}_results"][0]
             except:
                 # Set poster if content not have tmdb informations
-                if toast_ratings == '1':
+                if settings.toast_ratings:
                     if 'tt' in tmdb_meta[i].get('imdb_id', ''):
                         item['poster'] = f"{RATINGS_SERVER}/{item['type']}/get_poster/{language}/{tmdb_meta[i]['imdb_id']}.jpg"
-                elif rpdb == '1':
+                elif settings.rpdb:
                     if 'tt' in tmdb_meta[i].get('imdb_id', ''):
-                        if 't0' in rpdb_key:
+                        if settings.rpdb_free:
                             item['poster'] = f"https://api.ratingposterdb.com/{rpdb_key}/imdb/poster-default/{tmdb_meta[i]['imdb_id']}.jpg"
                         else:
                             item['poster'] = f"https://api.ratingposterdb.com/{rpdb_key}/imdb/poster-default/{tmdb_meta[i]['imdb_id']}.jpg?lang={language.split('-')[0]}"
-                elif top_stream_poster == '1':
+                elif settings.top_stream_poster:
                     if 'tt' in tmdb_meta[i].get('imdb_id', ''):
                         item['poster'] = f"https://api.top-streaming.stream/{top_stream_key}/imdb/poster-default/{tmdb_meta[i]['imdb_id']}.jpg?lang={language}"
 
@@ -106,14 +180,14 @@ def translate_catalog(original: dict, tmdb_meta: dict, top_stream_poster, toast_
                 except: pass
 
                 try: 
-                    if toast_ratings == '1':
+                    if settings.toast_ratings:
                         item['poster'] = f"{RATINGS_SERVER}/{item['type']}/get_poster/{language}/{tmdb_meta[i]['imdb_id']}.jpg"
-                    elif rpdb == '1':
-                        if 't0' in rpdb_key:
+                    elif settings.rpdb:
+                        if settings.rpdb_free:
                             item['poster'] = f"https://api.ratingposterdb.com/{rpdb_key}/imdb/poster-default/{tmdb_meta[i]['imdb_id']}.jpg"
                         else:
                             item['poster'] = f"https://api.ratingposterdb.com/{rpdb_key}/imdb/poster-default/{tmdb_meta[i]['imdb_id']}.jpg?lang={language.split('-')[0]}"
-                    elif top_stream_poster == '1':
+                    elif settings.top_stream_poster:
                         item['poster'] = f"https://api.top-streaming.stream/{top_stream_key}/imdb/poster-default/{tmdb_meta[i]['imdb_id']}.jpg?lang={language}"
                     else:
                         item['poster'] = tmdb.TMDB_POSTER_URL + detail['poster_path']
@@ -132,16 +206,16 @@ def translate_catalog(original: dict, tmdb_meta: dict, top_stream_poster, toast_
 
 async def translate_episodes(client: httpx.AsyncClient, original_episodes: list[dict], language: str, tmdb_key: str):
     translate_index = []
-    tasks = []
     new_episodes = original_episodes
 
     # Select not translated episodes
     for i, episode in enumerate(original_episodes):
         if 'tvdb_id' in episode:
-            tasks.append(tmdb.get_tmdb_data(client, episode['tvdb_id'], "tvdb_id", language, tmdb_key))
             translate_index.append(i)
 
-    translations = await asyncio.gather(*tasks)
+    tvdb_ids = [original_episodes[i]['tvdb_id'] for i in translate_index]
+    details = await tmdb.get_tmdb_data_many(client, tvdb_ids, "tvdb_id", language, tmdb_key)
+    translations = [details.get(tvdb_id, {}) for tvdb_id in tvdb_ids]
 
     # Translate episodes 
     for i, t_index in enumerate(translate_index):
@@ -0,0 +1,131 @@
+from cache import Cache
+from datetime import timedelta
+import coordination
+import breaker
+import httpx
+import copy
+import time
+import re
+
+# Fresh time when upstream does not send Cache-Control
+DEFAULT_TTL = timedelta(minutes=10).total_seconds()
+# Upper bound for upstream max-age
+MAX_TTL = timedelta(hours=6).total_seconds()
+# Stale entries are kept this long for conditional revalidation
+STALE_TTL = timedelta(days=1).total_seconds()
+# Meta sources (Cinemeta, kitsu addons): metas change rarely
+SOURCE_TTL = timedelta(hours=6).total_seconds()
+SOURCE_MAX_TTL = timedelta(days=1).total_seconds()
+
+# Cache set
+upstream_cache = None
+def open_cache():
+    global upstream_cache
+    upstream_cache = Cache('./cache/upstream/tmp', STALE_TTL, namespace='upstream')
+
+def close_cache():
+    global upstream_cache
+    upstream_cache.close()
+
+def get_cache_lenght():
+    global upstream_cache
+    return upstream_cache.get_len()
+
+
+async def get_json(client: httpx.AsyncClient, url: str, headers: dict = None, default_ttl: float = DEFAULT_TTL, max_ttl: float = MAX_TTL, source: str = None) -> tuple[int, dict | list | None]:
+    """
+    GET a JSON document through the upstream cache.
+    Returns (status_code, data), data is None when the body is not JSON.
+    With a `source` the call goes through its breaker: when the source is down
+    the stale entry is returned, or (None, None) without one.
+    """
+    entry = await upstream_cache.aget(url)
+    if entry != None and entry['fresh_until'] > time.time():
+        return entry['status'], copy.deepcopy(entry['data'])
+
+    status, data = await coordination.single_flight(
+        f"upstream:{url}",
+        lambda: revalidate(client, url, entry, headers, default_ttl, max_ttl, source),
+        lambda: fresh_lookup(url),
+        persist=upstream_cache.aflush
+    )
+    # Callers change the document: the queued one (shared with the other waiters) is not returned
+    return status, copy.deepcopy(data)
+
+
+async def get_source_meta(client: httpx.AsyncClient, source: str, url: str) -> tuple[int | None, dict | None]:
+    """
+    Meta of a source addon (Cinemeta, kitsu addons) shared by all the builders.
+    Returns (status_code, meta), meta is None when missing.
+    status_code is None when the source is down.
+    """
+    status, data = await get_json(client, url, None, SOURCE_TTL, SOURCE_MAX_TTL, source)
+    if status != 200 or not isinstance(data, dict) or not data.get('meta'):
+        return status, None
+    return status, data
+
+
+async def fresh_lookup(url: str):
+    entry = await upstream_cache.aget(url)
+    if entry != None and entry['fresh_until'] > time.time():
+        return entry['status'], entry['data']
+    return None
+
+
+async def revalidate(client: httpx.AsyncClient, url: str, entry: dict | None, headers: dict, default_ttl: float, max_ttl: float, source: str = None):
+    request_headers = dict(headers or {})
+    if entry != None:
+        if entry.get('etag'):
+            request_headers['if-none-match'] = entry['etag']
+        if entry.get('last_modified'):
+            request_headers['if-modified-since'] = entry['last_modified']
+
+    if source == None:
+        response = await client.get(url, headers=request_headers)
+    else:
+        try:
+            response = await breaker.get_breaker(source).get(client, url, headers=request_headers)
+        except (breaker.CircuitOpen, httpx.HTTPError):
+            # Source down, stale entry if any
+            if entry != None:
+                return entry['status'], entry['data']
+            return None, None
+    ttl = parse_ttl(response.headers.get('cache-control', ''), default_ttl, max_ttl)
+
+    # Not modified, refresh stored entry
+    if response.status_code == 304 and entry != None:
+        entry['fresh_until'] = time.time() + max(ttl, 0)
+        upstream_cache.set_later(url, entry)
+        return entry['status'], entry['data']
+
+    try:
+        data = response.json()
+    except ValueError:
+        data = None
+
+    if response.status_code == 200 and data != None and ttl >= 0:
+        upstream_cache.set_later(url, {
+            "status": response.status_code,
+            "data": data,
+            "etag": response.headers.get('etag'),
+            "last_modified": response.headers.get('last-modified'),
+            "fresh_until": time.time() + ttl
+        })
+
+    return response.status_code, data
+
+
+def parse_ttl(cache_control: str, default_ttl: float, max_ttl: float) -> float:
+    """
+    Fresh seconds from Cache-Control: -1 = do not store, 0 = store but always revalidate.
+    """
+    cache_control = cache_control.lower()
+    if 'no-store' in cache_control:
+        return -1
+    if 'no-cache' in cache_control:
+        return 0
+
+    max_age = re.search(r's-maxage=(\d+)', cache_control) or re.search(r'max-age=(\d+)', cache_control)
+    if max_age:
+        return min(int(max_age.group(1)), max_ttl)
+    return min(default_ttl, max_ttl)